@@ -0,0 +1,224 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import List, Dict
+
+import numpy as np
+
+import espixelstick
+import fixtures
+import img_proc
+import planner
+from capture import CaptureCache
+from color import ColorTransform
+from framebuffer import FrameBuffer
+from mapping import PixelStrip, SAMPLING_MODES
+from sources import SyntheticSource
+
+# Benchmarks for the hot path of send_data, stage by stage.  The screen is replaced with
+# synthetic frames (a still noise pattern, copied out on every grab like mss does) and the
+# output with an unflushed E1.31 sender, so this runs without any monitors or controllers
+# attached.
+#
+#   python bench.py                                # default resolutions & fixture counts
+#   python bench.py --output before.json           # save the results...
+#   python bench.py --compare before.json          # ...and compare a later run against them
+#
+# Fixture counts are made by repeating my 3 fixture desk setup (fixtures.py) on new universes
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4480x2130": (4480, 2130),
+}
+
+STAGES = ["capture", "resize", "sample", "color", "pack", "mapping"]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    arr = np.array(samples) * 1000
+    return {
+        "p50": float(np.percentile(arr, 50)),
+        "p90": float(np.percentile(arr, 90)),
+        "p99": float(np.percentile(arr, 99)),
+        "mean": float(arr.mean()),
+    }
+
+
+def create_setup(screen: SyntheticSource, fixture_count: int, sampling: str, color_transform: ColorTransform,
+                 capture_density: int):
+    capture_cache = CaptureCache(screen, pyramid=sampling == "pyramid")
+    pixel_strips = fixtures.create_fixtures(capture_cache, fixture_count, sampling=sampling,
+                                            color_transform=color_transform)
+    if capture_density > 0:
+        planner.plan_capture(pixel_strips, capture_density)
+
+    frame_buffer = FrameBuffer(pixel_strips)
+    for universe in frame_buffer.destinations:
+        frame_buffer.destinations[universe] = "127.0.0.1"
+    sender = espixelstick.create_sender(frame_buffer)
+
+    return capture_cache, pixel_strips, sender
+
+
+# Same work as send_data, with a timer around each stage
+def run_frame(capture_cache: CaptureCache, pixel_strips: List[PixelStrip], sender, timings: Dict[str, float]):
+    clock = time.perf_counter
+
+    t = clock()
+    capture_cache.new_frame()
+    for monitor_no in capture_cache.capture_boxes:
+        capture_cache.get(monitor_no)
+    timings["capture"] += clock() - t
+
+    for pixel_strip in pixel_strips:
+        img_x, img_y = pixel_strip.sample_size()
+        for region in pixel_strip.regions:
+            if pixel_strip.sampling == "pyramid":
+                t = clock()
+                img_proc.sample_pyramid(pixel_strip, region)
+                timings["sample"] += clock() - t
+                continue
+
+            t = clock()
+            img = region.capture_and_resize(img_x, img_y, False)
+            t2 = clock()
+            img_proc.create_color_data(img, pixel_strip, region)
+            t3 = clock()
+            timings["resize"] += t2 - t
+            timings["sample"] += t3 - t2
+
+        t = clock()
+        if pixel_strip.color_transform is not None:
+            pixel_strip.color_transform.apply(pixel_strip.color_data)
+        timings["color"] += clock() - t
+
+    # copying the frame buffer into the packets, the part of flush() that isn't the network
+    t = clock()
+    for output in sender.outputs.values():
+        output.pull()
+    timings["pack"] += clock() - t
+
+
+def bench(resolution: str, fixture_count: int, frames: int, warmup: int, sampling: str,
+          color_transform: ColorTransform, capture_density: int) -> Dict:
+    width, height = RESOLUTIONS[resolution]
+    screen = SyntheticSource(width, height, pattern="noise", speed=0, copy=True)
+    capture_cache, pixel_strips, sender = create_setup(screen, fixture_count, sampling, color_transform,
+                                                       capture_density)
+
+    samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    frame_times = []
+    for i in range(warmup + frames):
+        timings = {stage: 0.0 for stage in STAGES}
+        start = time.perf_counter()
+        run_frame(capture_cache, pixel_strips, sender, timings)
+        frame_time = time.perf_counter() - start
+
+        # the mapping is only generated at startup, but time it anyway since it's what decides
+        # how long startup takes with a lot of fixtures
+        t = time.perf_counter()
+        for pixel_strip in pixel_strips:
+            pixel_strip.generate_pixel_mapping(pixel_strip.start_left, pixel_strip.start_bottom)
+        timings["mapping"] = time.perf_counter() - t
+
+        if i >= warmup:
+            frame_times.append(frame_time)
+            for stage in STAGES:
+                samples[stage].append(timings[stage])
+
+    sender.socket.close()
+    return {
+        "resolution": resolution,
+        "fixtures": fixture_count,
+        "leds": sum(len(pixel_strip.pixels) for pixel_strip in pixel_strips),
+        "sampling": sampling,
+        "capture_density": capture_density,
+        "captured_pixels": capture_cache.pixels_per_frame(),
+        "frames": frames,
+        "fps": frames / sum(frame_times),
+        "frame": percentiles(frame_times),
+        "stages": {stage: percentiles(samples[stage]) for stage in STAGES},
+    }
+
+
+def print_result(result: Dict):
+    print(f"{result['resolution']:>10} {result['fixtures']:>4} fixtures {result['leds']:>6} leds "
+          f"{result['fps']:8.1f} fps  frame p50 {result['frame']['p50']:7.2f}ms p99 {result['frame']['p99']:7.2f}ms")
+    for stage, stats in result["stages"].items():
+        print(f"{'':>16}{stage:>8}: p50 {stats['p50']:7.2f}ms p90 {stats['p90']:7.2f}ms p99 {stats['p99']:7.2f}ms")
+
+
+def compare(results: List[Dict], previous: List[Dict]):
+    def key(result):
+        return result["resolution"], result["fixtures"], result["sampling"], result.get("capture_density", 0)
+
+    old_results = {key(result): result for result in previous}
+    print("\nCompared to previous run (p50, negative is faster):")
+    for result in results:
+        old = old_results.get(key(result))
+        if old is None:
+            continue
+        print(f"{result['resolution']:>10} {result['fixtures']:>4} fixtures: "
+              f"{old['fps']:8.1f} -> {result['fps']:8.1f} fps")
+        for stage, stats in result["stages"].items():
+            old_p50 = old["stages"].get(stage, {}).get("p50")
+            if not old_p50:
+                continue
+            change = (stats["p50"] - old_p50) / old_p50 * 100
+            print(f"{'':>16}{stage:>8}: {old_p50:7.2f}ms -> {stats['p50']:7.2f}ms ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='esp-bloom hot path benchmarks')
+    parser.add_argument('--resolutions', dest='resolutions', action='store', default=",".join(RESOLUTIONS),
+                        help=f'comma separated list of {", ".join(RESOLUTIONS)}')
+    parser.add_argument('--fixtures', dest='fixtures', action='store', default='4,16,64,128',
+                        help='comma separated fixture counts')
+    parser.add_argument('--frames', dest='frames', action='store', type=int, default=20,
+                        help='frames per run')
+    parser.add_argument('--warmup', dest='warmup', action='store', type=int, default=2,
+                        help='frames to run before measuring')
+    parser.add_argument('--sampling', dest='sampling', action='store', default='point', choices=SAMPLING_MODES,
+                        help='LED sampling mode')
+    parser.add_argument('--capture-density', dest='capture_density', action='store', type=int, default=16,
+                        help='screen lines captured per row of LEDs (0 to capture the whole region)')
+    parser.add_argument('--gamma', dest='gamma', action='store', type=float, default=2.2,
+                        help='gamma for the color stage')
+    parser.add_argument('--white', dest='white', action='store', type=float, default=1.0,
+                        help='white extraction for the color stage')
+    parser.add_argument('--output', dest='output', action='store', default=None,
+                        help='save results to this json file')
+    parser.add_argument('--compare', dest='compare', action='store', default=None,
+                        help='compare with results saved by a previous run')
+    args = parser.parse_args(argv)
+
+    color_transform = ColorTransform(gamma=args.gamma, white_extraction=args.white)
+
+    results = []
+    for resolution in args.resolutions.split(","):
+        for fixture_count in [int(n) for n in args.fixtures.split(",")]:
+            result = bench(resolution, fixture_count, args.frames, args.warmup, args.sampling, color_transform,
+                           args.capture_density)
+            print_result(result)
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "created": time.time(),
+                "python": sys.version,
+                "platform": platform.platform(),
+                "results": results,
+            }, f, indent=2)
+        print(f"saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
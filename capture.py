@@ -0,0 +1,144 @@
+import time
+from typing import Any, Dict, List, Tuple, Optional
+
+import numpy as np
+import PIL
+from PIL import Image
+
+import diagnostics
+import stats
+from pyramid import Pyramid
+from sources import FrameSource
+
+BoundingBox = Tuple[int, int, int, int]
+
+
+# Frame-scoped screenshot cache.  Every region registers the boxes it wants at startup, and
+# we grab each monitor once per frame.  Regions then sample their own box out of the shared
+# image instead of each calling mss.grab on their own (we used to grab the bottom of
+# monitors 1 and 3 twice per frame because of CombineRegion)
+#
+# Boxes on the same monitor that overlap or touch are merged into one grab.  Normally that's
+# the top + bottom of the screen in one piece, but with capture planning (see planner.py)
+# the regions only ask for thin bands where the LEDs are, and each band is its own grab
+#
+# The pixels come from a FrameSource (see sources.py), usually mss screenshots of the desktop
+#
+# downscale: keep only every n-th pixel and line of what's grabbed, before the conversion to RGB.
+# Boxes passed to get_region are still in screen coordinates
+#
+# pyramid: instead of RGB images, every grabbed box becomes a box-filtered Pyramid (pyramid.py)
+# built straight from the BGRA data, for strips that use "pyramid" sampling
+class CaptureCache:
+    def __init__(self, source: FrameSource, downscale: int = 1, pyramid: bool = False):
+        self.source = source
+        self.monitors = source.monitors
+        self.downscale = downscale
+        self.pyramid = pyramid
+
+        # counts new_frame() calls, regions that don't capture every frame go by this
+        self.frame_no = 0
+
+        # owner -> every (monitor_no, box) it asked for
+        self.requests: Dict[Any, List[Tuple[int, BoundingBox]]] = {}
+
+        # monitor_no -> the merged boxes we actually grab
+        self.capture_boxes: Dict[int, List[BoundingBox]] = {}
+
+        # monitor_no -> [(image, bounding box of the image)], cleared every frame
+        self.frames: Dict[int, List[Tuple[PIL.Image.Image, BoundingBox]]] = {}
+
+        # (monitor_no, box, size, band plan, resample filter) -> region already resized by a capture
+        # worker (see workers.py), cleared every frame
+        self.resized: Dict[tuple, PIL.Image.Image] = {}
+
+    def register(self, monitor_no: int, bb: BoundingBox, owner: Any = None):
+        self.requests.setdefault(owner, []).append((monitor_no, bb))
+        self.plan()
+
+    # Forget every box an owner asked for (e.g. a region that's switching to capture bands)
+    def unregister(self, owner: Any):
+        self.requests.pop(owner, None)
+        self.plan()
+
+    def plan(self):
+        boxes_by_monitor: Dict[int, List[BoundingBox]] = {}
+        for requests in self.requests.values():
+            for monitor_no, bb in requests:
+                boxes_by_monitor.setdefault(monitor_no, []).append(bb)
+
+        self.capture_boxes = {}
+        for monitor_no, boxes in boxes_by_monitor.items():
+            merged: List[BoundingBox] = []
+            for bb in sorted(boxes, key=lambda bb: bb[1]):
+                if merged and bb[1] <= merged[-1][3]:
+                    left, top, right, bottom = merged[-1]
+                    merged[-1] = (min(left, bb[0]), top, max(right, bb[2]), max(bottom, bb[3]))
+                else:
+                    merged.append(bb)
+            self.capture_boxes[monitor_no] = merged
+
+    # Number of pixels grabbed per frame, to see what the capture planning saves
+    def pixels_per_frame(self) -> int:
+        return sum((r - l) * (b - t) for boxes in self.capture_boxes.values() for l, t, r, b in boxes)
+
+    # Call at the start of each frame so the next get() grabs fresh data
+    def new_frame(self):
+        self.frames = {}
+        self.resized = {}
+        self.frame_no += 1
+        # decide whether the debug image tap samples this frame
+        diagnostics.new_frame()
+
+    # Store images that were captured somewhere else (e.g. a capture thread) for this frame
+    def store(self, monitor_no: int, images: List[Tuple[PIL.Image.Image, BoundingBox]]):
+        self.frames[monitor_no] = images
+
+    # Grab the monitor once, convert BGRX -> RGB once.  Sources (mss especially) can't be shared
+    # between threads, so capture threads pass in their own
+    def grab(self, monitor_no: int, source: Optional[FrameSource] = None) -> List[Tuple[PIL.Image.Image, BoundingBox]]:
+        t = time.perf_counter()
+        images = []
+        for bb in self.capture_boxes[monitor_no]:
+            screenshot = (source or self.source).grab(bb)
+            stride = getattr(screenshot, "stride", 0)
+            if self.pyramid:
+                img = Pyramid(self.bgra_array(screenshot.size, screenshot.bgra, stride)[::self.downscale, ::self.downscale], bb)
+            elif self.downscale > 1:
+                img = self.decimate(screenshot.size, screenshot.bgra, stride, self.downscale)
+            else:
+                img = PIL.Image.frombytes("RGB", screenshot.size, screenshot.bgra, "raw", "BGRX", stride)  # Convert to PIL.Image
+            images.append((img, bb))
+        stats.record(f"grab.monitor-{monitor_no}", time.perf_counter() - t)
+        return images
+
+    # Every n-th pixel of every n-th line.  The strided copy only touches the pixels we keep, so
+    # the copy, the BGRX -> RGB conversion and the resize after it all shrink by n^2
+    @staticmethod
+    def decimate(size: Tuple[int, int], bgra, stride: int, n: int) -> PIL.Image.Image:
+        small = np.ascontiguousarray(CaptureCache.bgra_array(size, bgra, stride)[::n, ::n])
+        return PIL.Image.frombytes("RGB", (small.shape[1], small.shape[0]), small, "raw", "BGRX")
+
+    # (h, w, 4) view of a screenshot, no copy
+    @staticmethod
+    def bgra_array(size: Tuple[int, int], bgra, stride: int) -> np.ndarray:
+        width, height = size
+        return np.ndarray((height, width, 4), dtype=np.uint8, buffer=bgra, strides=(stride or width * 4, 4, 1))
+
+    def get(self, monitor_no: int) -> List[Tuple[PIL.Image.Image, BoundingBox]]:
+        if monitor_no not in self.frames:
+            self.frames[monitor_no] = self.grab(monitor_no)
+        return self.frames[monitor_no]
+
+    # Returns the shared image containing the requested box plus the box relative to that image.
+    # Pass both to Image.resize(..., box=...) to resize straight out of the shared image without
+    # cropping a copy first.  The box is scaled to the image if it was downscaled
+    def get_region(self, monitor_no: int, bb: BoundingBox) -> Tuple[PIL.Image.Image, BoundingBox]:
+        for img, (left, top, right, bottom) in self.get(monitor_no):
+            if left <= bb[0] and top <= bb[1] and bb[2] <= right and bb[3] <= bottom:
+                if img.width == right - left and img.height == bottom - top:
+                    return img, (bb[0] - left, bb[1] - top, bb[2] - left, bb[3] - top)
+                sx = img.width / (right - left)
+                sy = img.height / (bottom - top)
+                return img, ((bb[0] - left) * sx, (bb[1] - top) * sy, (bb[2] - left) * sx, (bb[3] - top) * sy)
+        raise ValueError(f"box {bb} on monitor {monitor_no} was never registered with the capture cache")
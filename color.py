@@ -0,0 +1,91 @@
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+# Color correction that sits between sampling the screen and sending the DMX data.  Everything
+# is a table lookup or array op over a whole strip's (n, 4) RGBW buffer at once, a python loop
+# over the LEDs would blow the frame budget
+#
+# In order:
+# - gamma / white balance / brightness: one 256-entry lookup table per channel.  The screen colors
+#   are gamma encoded but the LEDs are linear, without gamma correction everything looks washed out
+# - white extraction: move the grey part of the color (min of R, G, B) into the W channel.  The SK6812
+#   W LED looks way better for whites/greys than mixing R+G+B
+# - current caps: scale LEDs down so a single LED (max_led) or the whole fixture (max_fixture) can't
+#   draw more than a fraction of full power (1.0 = every channel at 255)
+
+
+def _per_channel(value: Union[float, Sequence[float]]) -> np.ndarray:
+    if isinstance(value, (int, float)):
+        return np.full(3, value, dtype=np.float64)
+    return np.array(value, dtype=np.float64)
+
+
+class ColorTransform:
+    def __init__(self, gamma: Union[float, Sequence[float]] = 1.0,
+                 white_balance: Union[float, Sequence[float]] = 1.0,
+                 brightness: float = 1.0, white_extraction: float = 0.0,
+                 max_led: Optional[float] = None, max_fixture: Optional[float] = None):
+        self.gamma = _per_channel(gamma)
+        self.white_balance = _per_channel(white_balance)
+        self.brightness = brightness
+        self.white_extraction = white_extraction
+        self.max_led = max_led
+        self.max_fixture = max_fixture
+
+        self.lut = self.build_lut()
+
+    def __str__(self):
+        return (f"ColorTransform[gamma={self.gamma.tolist()},white_balance={self.white_balance.tolist()},"
+                f"brightness={self.brightness},white_extraction={self.white_extraction},"
+                f"max_led={self.max_led},max_fixture={self.max_fixture}]")
+
+    def __repr__(self):
+        return self.__str__()
+
+    # The R, G and B tables back to back, so all 3 channels go through a single np.take by
+    # offsetting G by 256 and B by 512
+    def build_lut(self) -> np.ndarray:
+        values = np.arange(256, dtype=np.float64) / 255
+        tables = [
+            255 * (values ** self.gamma[c]) * self.white_balance[c] * self.brightness
+            for c in range(3)
+        ]
+        return np.clip(np.rint(np.concatenate(tables)), 0, 255).astype(np.uint8)
+
+    # Apply to an (n, 4) uint8 RGBW buffer in place.  The W channel that comes in is ignored,
+    # it's computed here from the RGB data
+    def apply(self, color_data: np.ndarray) -> np.ndarray:
+        rgb = color_data[:, :3]
+        rgb[:] = np.take(self.lut, rgb + np.array([0, 256, 512], dtype=np.intp))
+
+        if self.white_extraction > 0:
+            white = rgb.min(axis=1)
+            if self.white_extraction < 1:
+                white = (white * self.white_extraction).astype(np.uint8)
+            rgb -= white[:, None]
+            color_data[:, 3] = white
+        else:
+            color_data[:, 3] = 0
+
+        if self.max_led is not None or self.max_fixture is not None:
+            self.limit_current(color_data)
+
+        return color_data
+
+    def limit_current(self, color_data: np.ndarray):
+        # current is roughly proportional to the sum of the channel values
+        load = color_data.sum(axis=1, dtype=np.float32) / (255 * 4)
+        scale = np.ones(len(color_data), dtype=np.float32)
+
+        if self.max_led is not None:
+            over = load > self.max_led
+            scale[over] = self.max_led / load[over]
+
+        if self.max_fixture is not None and len(color_data):
+            total = float(np.dot(load, scale)) / len(color_data)
+            if total > self.max_fixture:
+                scale *= self.max_fixture / total
+
+        if np.any(scale < 1):
+            color_data[:] = (color_data * scale[:, None]).astype(np.uint8)
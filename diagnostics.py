@@ -0,0 +1,180 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import numpy as np
+import PIL
+from PIL import Image
+
+import stats
+
+# Debug image tap.  --save used to write every screenshot / resized image as a PNG from inside
+# the draw loop, which takes longer than the whole frame and makes the choppiness you're trying
+# to look at a lot worse.
+#
+# Now the draw loop only offers images to the tap:
+# - frames are sampled ('fps' of them per second), on the other frames tap() returns right away
+# - on a sampled frame the image is copied into a bounded queue, when the queue is full the
+#   image is dropped (and counted) instead of waiting
+# - a background thread encodes and writes the PNGs
+#
+# Errors (e.g. an image that doesn't fit the pixel mapping) are written right away, sampled or
+# not, queue full or not: they're rare and usually the last thing before the process dies.
+# What's still queued when the process exits is written out too.
+#
+#   diagnostics.enable("saved-images", fps=1)
+#   ...
+#   diagnostics.new_frame()                      # CaptureCache.new_frame does this
+#   diagnostics.tap("monitor-1-top", img, box)   # crop of img, copied only on sampled frames
+
+TapImage = Union[PIL.Image.Image, np.ndarray]
+
+
+class DebugTap:
+    def __init__(self, directory: str = "saved-images", fps: float = 1.0, capacity: int = 8,
+                 compress_level: int = 1, clock: Callable[[], float] = time.perf_counter):
+        self.directory = directory
+        self.fps = fps
+        self.capacity = capacity
+        self.compress_level = compress_level
+        self.clock = clock
+
+        # sampled images are only taken when enabled, forced ones always
+        self.enabled = False
+        # True on the frames that get sampled
+        self.active = False
+        self.next_sample: Optional[float] = None
+
+        self.queue: queue.Queue = queue.Queue(maxsize=capacity)
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+        self.sampled_frames = 0
+        self.queued = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+
+    def __str__(self):
+        return f"DebugTap[{self.directory},fps={self.fps:g},capacity={self.capacity},enabled={self.enabled}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def enable(self, directory: Optional[str] = None, fps: Optional[float] = None):
+        if directory is not None:
+            self.directory = directory
+        if fps is not None:
+            self.fps = fps
+        self.enabled = True
+        self.next_sample = None
+
+    # Start of a frame: decide whether this one gets sampled
+    def new_frame(self, now: Optional[float] = None):
+        if not self.enabled:
+            self.active = False
+            return
+
+        now = self.clock() if now is None else now
+        if self.next_sample is None or now >= self.next_sample:
+            # no catching up on missed samples, the next one is a whole period from now
+            self.next_sample = now + (1 / self.fps if self.fps > 0 else 0)
+            self.active = True
+            self.sampled_frames += 1
+        else:
+            self.active = False
+
+    # Offer an image (or the box of it) to the tap.  Returns True if it was queued (or written,
+    # with force).  Never blocks, unless forced
+    def tap(self, name: str, img: TapImage, box: Optional[Tuple[int, int, int, int]] = None, force: bool = False) -> bool:
+        if force:
+            return self.write(name, self.copy(img, box))
+        if not self.active:
+            return False
+        if self.queue.full():
+            self.dropped += 1
+            stats.count("diagnostics.dropped")
+            return False
+
+        t = time.perf_counter()
+        copy = self.copy(img, box)
+        try:
+            self.queue.put_nowait((name, copy))
+        except queue.Full:
+            self.dropped += 1
+            stats.count("diagnostics.dropped")
+            return False
+        self.queued += 1
+        stats.record("diagnostics.tap", time.perf_counter() - t)
+
+        self.start()
+        return True
+
+    # Our own copy, the draw loop is free to reuse / change the original right after
+    @staticmethod
+    def copy(img: TapImage, box: Optional[Tuple[int, int, int, int]] = None) -> PIL.Image.Image:
+        if isinstance(img, np.ndarray):
+            if box is not None:
+                left, top, right, bottom = box
+                img = img[top:bottom, left:right]
+            return PIL.Image.fromarray(np.array(img, dtype=np.uint8))
+        return img.crop(box) if box is not None else img.copy()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.write_loop, name="diagnostics", daemon=True)
+                self.thread.start()
+
+    def write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.write(*item)
+
+    def write(self, name: str, img: PIL.Image.Image) -> bool:
+        t = time.perf_counter()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            img.save(os.path.join(self.directory, f"{name}.png"), compress_level=self.compress_level)
+            self.written += 1
+            return True
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            print(f"diagnostics: could not write {name}: {e}")
+            return False
+        finally:
+            stats.record("diagnostics.write", time.perf_counter() - t)
+
+    # Write out what's still queued and stop the writer
+    def close(self, timeout: float = 5.0):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is None:
+            return
+        self.queue.put(None)
+        thread.join(timeout=timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sampled_frames": self.sampled_frames,
+            "queued": self.queued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "errors": self.errors,
+        }
+
+
+# The process-wide tap
+default_tap = DebugTap()
+# the writer is a daemon thread, it doesn't get to finish on its own
+atexit.register(default_tap.close)
+
+enable = default_tap.enable
+new_frame = default_tap.new_frame
+tap = default_tap.tap
+close = default_tap.close
@@ -0,0 +1,271 @@
+import socket
+import time
+import uuid
+from typing import Dict, Optional, Iterable
+
+import numpy as np
+
+# Minimal E1.31 (sACN) output engine.
+#
+# Every universe keeps one preallocated packet.  The header is written once when the output
+# is activated, and each frame we only copy the channel data into the packet in place and
+# bump the sequence number, so there's no per-frame allocation.  flush() sends every
+# universe of the frame back to back on a single socket, followed by a sync packet when
+# synchronization is enabled, so receivers latch all universes of a frame at the same time
+# (the desk fixture is split across universes 3 and 4).
+#
+# Universes whose data hasn't changed since they were last sent are skipped, and only resent
+# every 'keepalive' seconds so the receivers don't hit their data loss timeout (2.5s in E1.31).
+# Most of the time the desktop is static, so this cuts out most of the traffic to the controllers
+#
+# An output can also be bound to a 512 channel view of the installation's frame buffer
+# (framebuffer.py), then flush() copies the view into the packet itself and nobody needs to
+# assign dmx_data every frame
+#
+# Packet layout is from ANSI E1.31-2018, section 4 (data packet) and 6.3 (sync packet)
+
+ACN_SDT_MULTICAST_PORT = 5568
+ACN_PACKET_IDENTIFIER = b"ASC-E1.17\x00\x00\x00"
+
+VECTOR_ROOT_E131_DATA = 0x00000004
+VECTOR_ROOT_E131_EXTENDED = 0x00000008
+VECTOR_E131_DATA_PACKET = 0x00000002
+VECTOR_E131_EXTENDED_SYNCHRONIZATION = 0x00000001
+VECTOR_DMP_SET_PROPERTY = 0x02
+
+DMX_CHANNELS = 512
+DATA_OFFSET = 126
+DATA_PACKET_LENGTH = DATA_OFFSET + DMX_CHANNELS
+SYNC_PACKET_LENGTH = 49
+
+# framing layer offsets
+SYNC_ADDRESS_OFFSET = 109
+SEQUENCE_OFFSET = 111
+OPTIONS_OFFSET = 112
+
+OPTION_STREAM_TERMINATED = 0x40
+
+
+def _flags_and_length(length: int) -> bytes:
+    return (0x7000 | length).to_bytes(2, "big")
+
+
+def build_data_packet(cid: bytes, source_name: str, universe: int, priority: int = 100, sync_universe: int = 0) -> bytearray:
+    packet = bytearray(DATA_PACKET_LENGTH)
+
+    # root layer
+    packet[0:2] = (0x0010).to_bytes(2, "big")  # preamble size
+    packet[2:4] = (0x0000).to_bytes(2, "big")  # postamble size
+    packet[4:16] = ACN_PACKET_IDENTIFIER
+    packet[16:18] = _flags_and_length(DATA_PACKET_LENGTH - 16)
+    packet[18:22] = VECTOR_ROOT_E131_DATA.to_bytes(4, "big")
+    packet[22:38] = cid
+
+    # framing layer
+    packet[38:40] = _flags_and_length(DATA_PACKET_LENGTH - 38)
+    packet[40:44] = VECTOR_E131_DATA_PACKET.to_bytes(4, "big")
+    packet[44:108] = source_name.encode("utf-8")[:63].ljust(64, b"\x00")
+    packet[108] = priority
+    packet[SYNC_ADDRESS_OFFSET:SYNC_ADDRESS_OFFSET+2] = sync_universe.to_bytes(2, "big")
+    packet[SEQUENCE_OFFSET] = 0
+    packet[OPTIONS_OFFSET] = 0
+    packet[113:115] = universe.to_bytes(2, "big")
+
+    # DMP layer
+    packet[115:117] = _flags_and_length(DATA_PACKET_LENGTH - 115)
+    packet[117] = VECTOR_DMP_SET_PROPERTY
+    packet[118] = 0xa1  # address type & data type
+    packet[119:121] = (0x0000).to_bytes(2, "big")  # first property address
+    packet[121:123] = (0x0001).to_bytes(2, "big")  # address increment
+    packet[123:125] = (DMX_CHANNELS + 1).to_bytes(2, "big")  # property value count (+1 for the start code)
+    packet[125] = 0x00  # DMX start code
+
+    return packet
+
+
+def build_sync_packet(cid: bytes, sync_universe: int) -> bytearray:
+    packet = bytearray(SYNC_PACKET_LENGTH)
+
+    # root layer
+    packet[0:2] = (0x0010).to_bytes(2, "big")
+    packet[2:4] = (0x0000).to_bytes(2, "big")
+    packet[4:16] = ACN_PACKET_IDENTIFIER
+    packet[16:18] = _flags_and_length(SYNC_PACKET_LENGTH - 16)
+    packet[18:22] = VECTOR_ROOT_E131_EXTENDED.to_bytes(4, "big")
+    packet[22:38] = cid
+
+    # framing layer
+    packet[38:40] = _flags_and_length(SYNC_PACKET_LENGTH - 38)
+    packet[40:44] = VECTOR_E131_EXTENDED_SYNCHRONIZATION.to_bytes(4, "big")
+    packet[44] = 0  # sequence number
+    packet[45:47] = sync_universe.to_bytes(2, "big")
+    # 47-48 reserved
+
+    return packet
+
+
+# One universe.  Mimics the bits of sacn's output object we use, so `sender[universe].dmx_data = ...`
+# still works, but the data is copied straight into the preallocated packet
+class E131Output:
+    def __init__(self, sender: "E131Sender", universe: int, destination: str):
+        self.sender = sender
+        self.universe = universe
+        self.destination = destination
+        self.packet = build_data_packet(sender.cid, sender.source_name, universe, sender.priority, sender.sync_universe or 0)
+        self.data = memoryview(self.packet)[DATA_OFFSET:]
+        self.length = 0
+
+        # bound frame buffer view, copied into the packet on every flush
+        self.source: Optional[memoryview] = None
+
+        # what the receiver is currently showing
+        self.last_sent = bytearray(DMX_CHANNELS)
+        self.last_sent_at = float("-inf")
+
+        self.packets_sent = 0
+        self.packets_suppressed = 0
+
+    @property
+    def dmx_data(self) -> bytes:
+        return bytes(self.data)
+
+    # Accepts bytes/bytearray/memoryview, contiguous uint8 numpy arrays, or a tuple/list of ints.
+    # Like sacn, anything past 512 channels is dropped
+    @dmx_data.setter
+    def dmx_data(self, data):
+        if isinstance(data, (tuple, list)):
+            data = bytes(data[:DMX_CHANNELS])
+        data = memoryview(data).cast("B")[:DMX_CHANNELS]
+
+        length = len(data)
+        self.data[:length] = data
+        if length < self.length:
+            self.data[length:self.length] = bytes(self.length - length)
+        self.length = length
+
+        if not self.sender.manual_flush:
+            self.sender.flush([self.universe])
+
+    def pull(self):
+        if self.source is not None:
+            self.data[:] = self.source
+            self.length = DMX_CHANNELS
+
+    def next_sequence(self):
+        self.packet[SEQUENCE_OFFSET] = (self.packet[SEQUENCE_OFFSET] + 1) & 0xff
+
+    # threshold: largest per-channel difference that still counts as unchanged (0 = exact match)
+    def changed(self, threshold: int) -> bool:
+        if threshold <= 0:
+            return self.data != self.last_sent
+        new = np.frombuffer(self.packet, dtype=np.uint8, offset=DATA_OFFSET)
+        old = np.frombuffer(self.last_sent, dtype=np.uint8)
+        return bool(np.any(np.abs(new.astype(np.int16) - old) > threshold))
+
+    def needs_send(self, now: float, threshold: int, keepalive: float) -> bool:
+        return now - self.last_sent_at >= keepalive or self.changed(threshold)
+
+    def mark_sent(self, now: float):
+        self.last_sent[:] = self.data
+        self.last_sent_at = now
+        self.packets_sent += 1
+
+
+# keepalive: seconds between resends of a universe that hasn't changed (0 sends every universe every frame)
+# change_threshold: per-channel difference below which a universe counts as unchanged
+class E131Sender:
+    def __init__(self, source_name: str = "esp-bloom", priority: int = 100, sync_universe: Optional[int] = None,
+                 bind_address: str = "", port: int = ACN_SDT_MULTICAST_PORT,
+                 keepalive: float = 1.0, change_threshold: int = 0):
+        self.source_name = source_name
+        self.priority = priority
+        self.sync_universe = sync_universe
+        self.port = port
+        self.keepalive = keepalive
+        self.change_threshold = change_threshold
+        self.cid = uuid.uuid4().bytes
+
+        # when False, every dmx_data assignment is sent right away
+        self.manual_flush = False
+
+        self.outputs: Dict[int, E131Output] = {}
+        self.sync_packet = build_sync_packet(self.cid, sync_universe) if sync_universe else None
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((bind_address, 0))
+
+    def __getitem__(self, universe: int) -> Optional[E131Output]:
+        return self.outputs.get(universe)
+
+    def activate_output(self, universe: int, destination: str):
+        self.outputs[universe] = E131Output(self, universe, destination)
+
+    # Send this 512 channel view (e.g. FrameBuffer.universes[universe]) on every flush
+    def bind(self, universe: int, source: memoryview):
+        source = memoryview(source).cast("B")
+        if len(source) != DMX_CHANNELS:
+            raise ValueError(f"universe {universe}: bound data has to be {DMX_CHANNELS} channels, got {len(source)}")
+        self.outputs[universe].source = source
+
+    def deactivate_output(self, universe: int):
+        self.outputs.pop(universe, None)
+
+    # kept so this can be swapped in for sacn.sACNsender, there's no sending thread to start
+    def start(self):
+        pass
+
+    # Send one frame: every universe (or just the ones given) that changed or is due for a
+    # keepalive, then a sync packet to every receiver so they all show the frame at the same time.
+    # force sends everything regardless, pull=False sends the packets as they are without
+    # copying in the bound frame buffer first
+    def flush(self, universes: Optional[Iterable[int]] = None, force: bool = False, pull: bool = True):
+        outputs = self.outputs.values() if universes is None else [self.outputs[u] for u in universes]
+        if pull:
+            for output in outputs:
+                output.pull()
+
+        sendto = self.socket.sendto
+        port = self.port
+        now = time.monotonic()
+        destinations = set()
+        for output in outputs:
+            if not force and not output.needs_send(now, self.change_threshold, self.keepalive):
+                output.packets_suppressed += 1
+                continue
+            output.next_sequence()
+            sendto(output.packet, (output.destination, port))
+            output.mark_sent(now)
+            destinations.add(output.destination)
+
+        if self.sync_packet is not None and destinations:
+            self.sync_packet[44] = (self.sync_packet[44] + 1) & 0xff
+            for destination in destinations:
+                sendto(self.sync_packet, (destination, port))
+
+    # Turn every LED off.  UDP can drop packets so the blackout is sent a few times, then we
+    # tell the receivers the stream is done so they don't wait for the data loss timeout
+    def blackout(self, repeat: int = 3):
+        for output in self.outputs.values():
+            output.data[:] = bytes(DMX_CHANNELS)
+
+        for _ in range(repeat):
+            self.flush(force=True, pull=False)
+
+        # receivers are allowed to ignore sync from a stream that terminated, so terminate
+        # without a sync address
+        for output in self.outputs.values():
+            output.packet[OPTIONS_OFFSET] |= OPTION_STREAM_TERMINATED
+            output.packet[SYNC_ADDRESS_OFFSET:SYNC_ADDRESS_OFFSET+2] = bytes(2)
+        sync_packet, self.sync_packet = self.sync_packet, None
+        for _ in range(repeat):
+            self.flush(force=True, pull=False)
+
+        # put the packets back so the sender can be used again
+        for output in self.outputs.values():
+            output.packet[OPTIONS_OFFSET] &= ~OPTION_STREAM_TERMINATED & 0xff
+            output.packet[SYNC_ADDRESS_OFFSET:SYNC_ADDRESS_OFFSET+2] = (self.sync_universe or 0).to_bytes(2, "big")
+        self.sync_packet = sync_packet
+
+    def stop(self):
+        self.blackout()
+        self.socket.close()
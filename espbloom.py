@@ -5,79 +5,106 @@ from pprint import pprint
 from typing import List, Dict
 
 import PIL
-from PIL import Image
 import time
 import sys
 
-import mss
-from mss import models
-from mss.screenshot import ScreenShot
-
 import espixelstick
-from mapping import PixelAddress, PixelStrip
+import fixtures
+import planner
+from mapping import SAMPLING_MODES
 import img_proc
 
 import signal
 import sys
 
-from region import ScreenRegion, CombineRegion
-
+from capture import CaptureCache
+from framebuffer import FrameBuffer
+from interpolation import FrameInterpolator, MODES as INTERPOLATION_MODES
+from quality import QualityController, default_levels
+from workers import CaptureWorkers
+from recording import Recorder, Recording, replay
+from e131 import E131Sender
+import diagnostics
+import idle
+import sources
+from scheduler import FrameClock, OutputScheduler, create_fixture_schedules
+from pipeline import Pipeline, send_data
+from color import ColorTransform
+import stats
+
+# set when running in --pipeline / --capture-workers / --record mode
+pipeline = None
+capture_workers = None
+recorder = None
 
 def signal_handler(sig, frame):
     print('Exiting...')
 
-    # this doesn't turn off the leds for some reason
-    # TODO: shut off the LEDs when we exit
-    for i in range(1, 3):
-        if sender[i] is not None:
-            sender[i].dmx_data = (0, 0, 0, 0)
+    if pipeline is not None:
+        pipeline.stop()
+    if capture_workers is not None:
+        capture_workers.close()
+    if recorder is not None:
+        recorder.close()
+        print(f"recorded {recorder.frames} frames to {recorder.path}")
 
-    sender.stop()  # do not forget to stop the sender
+    sender.stop()  # do not forget to stop the sender, this also blacks out the strips
+    diagnostics.close()
     sys.exit(0)
 signal.signal(signal.SIGINT, signal_handler)
 
 
-def send_data(sender, pixel_strips: List[PixelStrip], save_image):
-    # Turn off automatic flushing so we can send everything at the same time
-    sender.manual_flush = True
-    for pixel_strip in pixel_strips:
-        pixel_data = []
-        for region in pixel_strip.regions:
-            img = region.capture_and_resize(pixel_strip.max_row_length, pixel_strip.rows, save_image)
-            pixel_data += img_proc.create_color_data(img, pixel_strip, region)
+# Print the frame clock numbers along with the per-stage timings
+def print_stats(clock_report: str):
+    print(clock_report)
+    print(stats.report_line())
 
-        # print number of pixels
-        # print(len(pixel_data)/4)
 
-        # Set pixel data for the universe
-        sender[pixel_strip.universe].dmx_data = pixel_data
+# argparse type for rates, a frame clock can't run at 0 fps
+def positive_float(value: str) -> float:
+    try:
+        rate = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a number: {value}")
+    if not rate > 0:
+        raise argparse.ArgumentTypeError(f"has to be more than 0, got {value}")
+    return rate
 
-    # Flush all data
-    sender.flush()
 
-    # Reenable automatic flushing
-    sender.manual_flush = False
+# --fixture-fps / --fixture-priority values: STRIP=VALUE, by the strip's address
+def parse_fixture_settings(values: List[str], cast) -> Dict[str, float]:
+    settings = {}
+    for value in values or []:
+        strip_addr, _, setting = value.partition("=")
+        if not setting:
+            parser.error(f"expected STRIP=VALUE, got {value}")
+        try:
+            settings[strip_addr] = cast(setting)
+        except (ValueError, argparse.ArgumentTypeError) as e:
+            parser.error(f"{value}: {e}")
+    return settings
 
 
 def flatten(l: List) -> List:
     return list(itertools.chain.from_iterable(l))
 
 # Send a solid color that changes every 2s
-# This doesn't use the pixel mapping structure, it just spams solid colors to the DMX
-# universes defined in 'pixel_strips'.  Tests the physical LED wiring and controller setup
+# This doesn't use the pixel mapping structure, it just fills every LED of the strips in
+# 'pixel_strips' with solid colors.  Tests the physical LED wiring and controller setup
 # ONLY (does not test the pixel mapping)
 def test_strips(pixel_strips):
     sample_data = {
-        "red": (255, 0, 0, 0) * 300,
-        "green": (0, 255, 0, 0) * 300,
-        "blue": (0, 0, 255, 0) * 300,
+        "red": (255, 0, 0, 0),
+        "green": (0, 255, 0, 0),
+        "blue": (0, 0, 255, 0),
     }
     color_iter = itertools.cycle(sample_data.values())
 
     for i in range(20):
-        color_data = next(color_iter)
+        color = next(color_iter)
         for pixel_strip in pixel_strips:
-            sender[pixel_strip.universe].dmx_data = color_data
+            pixel_strip.color_data[:] = color
+        sender.flush()
 
         time.sleep(1)
 
@@ -87,10 +114,8 @@ def test_strips(pixel_strips):
 # Turn off the LEDs
 def strips_off(pixel_strips):
     print("Turning strips off")
-    for pixel_strip in pixel_strips:
-        sender[pixel_strip.universe].dmx_data = (0, 0, 0, 0) * 1000
     sender.stop()
-    print("Turned strips off.  This doesn't always exit, you might need to press ctrl+c again")
+    print("Turned strips off")
 
 
 ################################################################################################################################################
@@ -99,116 +124,209 @@ parser = argparse.ArgumentParser(description='esp-based bias lighting')
 parser.add_argument('--debug', dest='debug', action='store_true', default=False, help='debug mode (print debug logs)')
 parser.add_argument('--test', dest='test', action='store_true', default=False, help='test mode (spam solid colors)')
 parser.add_argument('--slow', dest='slow', action='store_true', default=False, help='slow mode (3 fps)')
-parser.add_argument('--save', dest='save', action='store_true', default=False, help='save png image files for debugging')
+parser.add_argument('--save', dest='save', action='store_true', default=False, help='save png image files for debugging (sampled, written in the background)')
+parser.add_argument('--save-fps', dest='save_fps', action='store', type=float, default=1.0, help='frames per second --save samples')
+parser.add_argument('--save-dir', dest='save_dir', action='store', default='saved-images', help='where --save and error images go')
 parser.add_argument('--off', dest='off', action='store_true', default=False, help='turn strips off')
+parser.add_argument('--source', dest='source', action='store', default='mss', help='where frames come from: mss, synthetic[:WIDTHxHEIGHT[:noise|gradient|bars]], file:PATH (video, image, directory or glob), shm:PATH (shared memory ring buffer)')
+parser.add_argument('--capture-density', dest='capture_density', action='store', type=int, default=16, help='screen lines captured per row of LEDs (0 to capture the whole region)')
+parser.add_argument('--sampling', dest='sampling', action='store', default='point', choices=SAMPLING_MODES, help='LED sampling mode (point: 1 resized pixel per LED, area: average of the area each LED covers, pyramid: average of each LED\'s footprint on the screen, out of a shared image pyramid)')
+parser.add_argument('--gamma', dest='gamma', action='store', type=float, default=1.0, help='gamma correction for the LEDs (2.2 is a good start)')
+parser.add_argument('--white-balance', dest='white_balance', action='store', default='1,1,1', help='r,g,b multipliers to correct the white point of the strips')
+parser.add_argument('--brightness', dest='brightness', action='store', type=float, default=1.0, help='global brightness (0-1)')
+parser.add_argument('--white', dest='white', action='store', type=float, default=0.0, help='how much of the grey in each color to move to the W channel (0-1)')
+parser.add_argument('--max-led', dest='max_led', action='store', type=float, default=None, help='max power for a single LED, as a fraction of every channel at 255')
+parser.add_argument('--max-fixture', dest='max_fixture', action='store', type=float, default=None, help='max power for a whole fixture, as a fraction of every LED at full power')
+parser.add_argument('--sync-universe', dest='sync_universe', action='store', type=int, default=None, help='send an E1.31 sync packet on this universe after every frame so all universes update together')
+parser.add_argument('--keepalive', dest='keepalive', action='store', type=float, default=1.0, help='seconds between resends of universes whose data has not changed (0 to send every universe every frame)')
+parser.add_argument('--change-threshold', dest='change_threshold', action='store', type=int, default=0, help='largest per-channel difference that still counts as unchanged')
+parser.add_argument('--pipeline', dest='pipeline', action='store_true', default=False, help='pipeline mode (run capture / process / transmit concurrently in separate threads)')
+parser.add_argument('--capture-workers', dest='capture_workers', action='store_true', default=False, help='grab and resize every monitor in its own worker process, in parallel')
 parser.add_argument('--profile', dest='profile', action='store_true', default=False, help='profile (create cProfile profile for debugging performance)')
-# parser.add_argument('--fps', dest='fps', action='store', default=30, help='fps')
+parser.add_argument('--fps', dest='fps', action='store', type=positive_float, default=30, help='target frames per second')
+parser.add_argument('--capture-fps', dest='capture_fps', action='store', type=positive_float, default=None, help='capture the screen at this rate and interpolate the LEDs up to --fps in between (default: capture every frame)')
+parser.add_argument('--interpolation', dest='interpolation', action='store', default='linear', choices=INTERPOLATION_MODES, help='how to fill in frames between captures (linear: fade over one capture period, ema: exponential smoothing)')
+parser.add_argument('--smoothing', dest='smoothing', action='store', type=float, default=0.1, help='time constant of the ema interpolation in seconds')
+parser.add_argument('--budget-ms', dest='budget_ms', action='store', type=float, default=None, help='frame time budget (90th percentile), capture quality is turned down at runtime to stay inside it')
+parser.add_argument('--cpu-budget', dest='cpu_budget', action='store', type=float, default=None, help='CPU budget in percent of one core, capture quality is turned down at runtime to stay inside it')
+parser.add_argument('--idle-after', dest='idle_after', action='store', type=float, default=0, help='seconds a region has to stay unchanged before it drops to the idle capture rate (default 0: always capture at full rate).  The first change after going idle shows up at the next idle capture')
+parser.add_argument('--idle-fps', dest='idle_fps', action='store', type=float, default=2.0, help='capture rate of regions that are idle')
+parser.add_argument('--record', dest='record', action='store', default=None, help='record every frame sent to the LEDs to this file')
+parser.add_argument('--record-regions', dest='record_regions', action='store_true', default=False, help='also record the resized region images')
+parser.add_argument('--replay', dest='replay', action='store', default=None, help='play a recording back to the controllers with its original timing, nothing is captured')
+parser.add_argument('--loop', dest='loop', action='store_true', default=False, help='loop --replay')
+parser.add_argument('--fixture-fps', dest='fixture_fps', action='append', default=None, help='STRIP=FPS: update rate of one fixture (by address), the others run at --fps.  Can be repeated')
+parser.add_argument('--fixture-priority', dest='fixture_priority', action='append', default=None, help='STRIP=N: priority of one fixture when the scheduler is short on time (higher goes first, the monitors default to 1).  Can be repeated')
+parser.add_argument('--schedule-budget', dest='schedule_budget', action='store', type=float, default=0.8, help='fraction of a frame the scheduler spends before deferring lower priority fixtures to the next one')
+parser.add_argument('--stats-port', dest='stats_port', action='store', type=int, default=None, help='serve per-stage timing stats as json on http://127.0.0.1:<port>/')
+parser.add_argument('--no-timing', dest='timing', action='store_false', default=True, help='turn off per-stage timing')
+parser.add_argument('--stats-interval', dest='stats_interval', action='store', type=float, default=10, help='seconds between frame rate / jitter / dropped frame reports (0 to disable)')
 args = parser.parse_args()
 
 if args.debug:
     print("DEBUG MODE ENABLED")
     logging.basicConfig(level=logging.DEBUG)
 
-frame_rate = 3 if args.debug or args.slow else 30
-
-# I probably don't wanna do the sleep time thing, because this doesn't at all take
-# into account how long it took to process the images.  probably responsible
-# for some of the choppiness.  replace with asyncio or something like timeloop
-# TODO: try out this and see if it helps: https://github.com/sankalpjonn/timeloop
-sleep_time = round(1/frame_rate, 3)-.001
-
-### A lot of the code below is very specific to my specific pixel setup.  The setup consists of:
-# LED type: these are SK6812 LEDs which are RGBW.  This is what I already had in channels w/ connectors
-# I would have preferred to use APA102 LEDs but I didn't have them in channels.  The RGBW LEDs require 4 DMX channels per light
-# which reduces the number of LEDs we can have in a DMX Universe.  That's definitely a downside to these LEDs
-# (DMX universes can have 512 lights, and each individual LED is RGBW=4x lights).
-#
-# 3 distinct LED fixtures
-# - each fixture uses 1 esp8266 (dev board)
-#
-# - right monitor
-#   - dmx universe 1
-#   - 4 rows x 29 pixels in horizontal zigzag pattern starting at lower left
-#
-# - left monitor
-#   - dmx universe 2
-#   - 4 rows x 29 pixels in horizontal zigzag pattern starting at lower left
-#
-# - desk
-#   - dmx universe 3+4
-#   - 3 rows, horizontal zigzag, starting at upper right
-#   - row #1 (dmx universe 3)
-#     - back of desk, 75 pixels
-#   - row #2 - first part - 53 pixels in universe #3
-#   - row #2 - second part - 18 pixels in universe #4
-#     - row 2 is split due to universe size limit
-#   - row #3 - 71 pixels (dmx universe 4)
-#     - row #2 and #3 are in the middle of the desk facing downwards
-
-# function to determine if a specific pixel falls into a specific region
-# used for the monitors which have 4x rows of 29 pixels each
-# this is how we determine which LEDs should get the top of a screen vs the bottom of a screen
-# this functionality should really be refactored to use the newer ScreenRegion class
-def _region_fn_monitors(pixel: PixelAddress) -> str:
-    if pixel.index < 29*2:
-        return "bottom"
+frame_rate = 3 if args.debug or args.slow else args.fps
+
+# The frame clock schedules frames against absolute deadlines, so the time it takes to
+# capture and process the images comes out of the frame budget instead of adding to it
+frame_clock = FrameClock(frame_rate, report_interval=args.stats_interval, on_report=print_stats)
+
+stats.default_stats.enabled = args.timing
+stats.add_source("clock", lambda: {
+    "fps": frame_clock.achieved_fps(), "jitter_ms": frame_clock.jitter() * 1000,
+    "frames": frame_clock.total_frames, "dropped": frame_clock.total_dropped,
+})
+if args.stats_port:
+    stats.serve(args.stats_port)
+
+# Debug images are sampled and written by a background thread, so saving them doesn't slow
+# the frames down.  Error images always go to save_dir
+diagnostics.default_tap.directory = args.save_dir
+if args.save:
+    diagnostics.enable(fps=args.save_fps)
+    stats.add_source("diagnostics", diagnostics.default_tap.stats)
+
+# Play back a recording, the screen isn't touched
+if args.replay:
+    recording = Recording(args.replay)
+    print(f"replaying {recording}")
+    sender = E131Sender(sync_universe=args.sync_universe, keepalive=args.keepalive, change_threshold=args.change_threshold)
+    sender.manual_flush = True
+    for universe, destination in recording.destinations.items():
+        sender.activate_output(universe, destination)
+
+    replay(recording, sender, loop=args.loop)
+    recording.close()
+    sender.stop()
+    sys.exit(0)
+
+frame_source = sources.open_source(args.source)
+capture_cache = CaptureCache(frame_source, pyramid=args.sampling == 'pyramid')
+
+color_transform = ColorTransform(
+    gamma=args.gamma, white_balance=[float(c) for c in args.white_balance.split(",")],
+    brightness=args.brightness, white_extraction=args.white,
+    max_led=args.max_led, max_fixture=args.max_fixture,
+)
+
+# The list of pixels strips.  The layout of my setup lives in fixtures.py
+pixel_strips = fixtures.create_pixel_strips(capture_cache, sampling=args.sampling, color_transform=color_transform)
+
+# Per-fixture rates / priorities.  Giving any turns on the output scheduler
+fixture_fps = parse_fixture_settings(args.fixture_fps, positive_float)
+fixture_priority = parse_fixture_settings(args.fixture_priority, int)
+strips_by_addr = {pixel_strip.strip_addr: pixel_strip for pixel_strip in pixel_strips}
+for strip_addr in list(fixture_fps) + list(fixture_priority):
+    if strip_addr not in strips_by_addr:
+        parser.error(f"unknown fixture {strip_addr}, expected one of {', '.join(strips_by_addr)}")
+for strip_addr, fps in fixture_fps.items():
+    strips_by_addr[strip_addr].fps = fps
+for strip_addr, priority in fixture_priority.items():
+    strips_by_addr[strip_addr].priority = priority
+scheduled = bool(fixture_fps or fixture_priority) and not args.test
+
+# Only grab the parts of the screen the LEDs actually look at
+if args.capture_density > 0:
+    planner.plan_capture(pixel_strips, args.capture_density)
+
+# Capture regions that aren't changing at a low rate (off unless --idle-after is given).
+# Counted in captures, so with --capture-fps the idle timing is relative to that.  The
+# pipeline's capture threads still grab every frame, there it only saves the resizing
+capture_rate = min(args.capture_fps or frame_rate, frame_rate)
+regions = idle.enable_idle_detection(pixel_strips, idle_after=round(args.idle_after * capture_rate),
+                                     idle_interval=max(round(capture_rate / args.idle_fps), 1) if args.idle_fps else 1)
+stats.add_source("idle", lambda: {
+    region.label(): region.change_detector.idle
+    for region in regions if region.change_detector is not None
+})
+
+# Trade capture quality for frame time / CPU at runtime
+quality = None
+if args.budget_ms or args.cpu_budget:
+    if args.pipeline:
+        # the capture threads would be grabbing boxes while the controller replans them
+        print("--budget-ms / --cpu-budget are ignored in pipeline mode")
+    else:
+        quality = QualityController(pixel_strips, capture_cache, budget_ms=args.budget_ms,
+                                    cpu_budget=args.cpu_budget / 100 if args.cpu_budget else None,
+                                    levels=default_levels(args.capture_density))
+        stats.add_source("quality", quality.stats)
+
+# All the strips' color data lives in one buffer, the universes are slices of it
+frame_buffer = FrameBuffer(pixel_strips)
+
+# Capture slower than we send, and interpolate the frames in between
+interpolator = None
+if args.capture_fps and args.capture_fps < frame_rate and scheduled:
+    print("--capture-fps is ignored with per-fixture rates")
+elif args.capture_fps and args.capture_fps < frame_rate and not args.test:
+    interpolator = FrameInterpolator(frame_buffer.buffer.size, args.capture_fps, mode=args.interpolation,
+                                     smoothing=args.smoothing)
+    print(f"capturing at {args.capture_fps:g} fps, sending at {frame_rate:g} fps: {interpolator}")
+
+sender = espixelstick.create_sender(frame_buffer, sync_universe=args.sync_universe,
+                                    keepalive=args.keepalive, change_threshold=args.change_threshold,
+                                    buffer=interpolator.output if interpolator is not None else None)
+stats.add_source("universes", lambda: {
+    universe: {"sent": output.packets_sent, "suppressed": output.packets_suppressed}
+    for universe, output in sender.outputs.items()
+})
+
+# Fork the capture workers before the recorder is opened, so they don't inherit its buffered
+# header
+if args.capture_workers:
+    if args.pipeline:
+        print("--capture-workers is ignored in pipeline mode (it has its own capture threads)")
+    elif args.sampling == 'pyramid':
+        print("--capture-workers is ignored with pyramid sampling (the workers hand back resized images)")
     else:
-        return "top"
-
-mss_instance = mss.mss()
-
-regionTop3 = ScreenRegion("top", 3, mss_instance)
-regionBottom3 = ScreenRegion("bottom", 3, mss_instance)
-regionTop1 = ScreenRegion("top", 1, mss_instance)
-regionBottom1 = ScreenRegion("bottom", 1, mss_instance)
-allBottom = CombineRegion("bottom", 1, mss_instance)
-
-# The list of pixels strips.  The PixelStrip has kind of grown into a catch-all for a bunch of functionality & data
-pixel_strips = [
-    # 192.168.1.237
-    PixelStrip(
-        strip_addr="192.168.1.237", universe=1, row_length=[29,29,29,29], rows=4, start_left=True,
-        start_bottom=True, region_fn=_region_fn_monitors,
-        regions=[regionBottom3, regionTop3],
-    ),
-
-    PixelStrip(
-        strip_addr="192.168.1.240", universe=2, row_length=[29,29,29,29], rows=4, start_left=True,
-        start_bottom=True, region_fn=_region_fn_monitors,
-        regions=[regionBottom1, regionTop1],
-    ),
-
-    PixelStrip(
-        strip_addr="192.168.1.243", universe=3, row_length=[75, 53], rows=2, start_left=False,
-        start_bottom=False, region_fn=lambda _: "bottom",
-        regions=[allBottom],
-    ),
-
-    # # 29 in first channel
-    # # 42 in second in 2nd channel
-    ## 24 in second channel that are part of universe 3
-    # # 29+24 in universe 3, remainder (18) in universe 4
-    # # 71 total
-    # This one has the most complicated mapping due to the mismatched row lengths and that
-    # it actually encompasses multiple DMX universes :/
-    # the mapping doesn't work 100% here yet, there's something wrong with the offset calculations
-    # in mapping.py.  its a few pixels off.  it could also be that we don't handle matrices with
-    # multiple different row_lengths correctly when mapping screen pixels to led pixels
-    PixelStrip(
-        strip_addr="192.168.1.243", universe=4, row_length=[18, 71], rows=2, start_left=True,
-        start_bottom=False, region_fn=lambda _: "bottom",
-        regions=[allBottom], first_pixel_offset=53, max_row_length=71,
-    ),
-]
-
-sender = espixelstick.create_sender(pixel_strips, fps=frame_rate)
+        capture_workers = CaptureWorkers(pixel_strips, capture_cache, args.source)
+
+if args.record:
+    recorded_regions = {}
+    if args.record_regions:
+        for pixel_strip in pixel_strips:
+            for region in pixel_strip.regions:
+                recorded_regions.setdefault(region, pixel_strip.sample_size())
+    recorder = Recorder(args.record, sender, regions=list(recorded_regions.items()), fps=frame_rate)
+
+# Update every fixture at its own rate, highest priority first
+scheduler = None
+if scheduled:
+    if args.pipeline:
+        print("--fixture-fps / --fixture-priority are ignored in pipeline mode")
+    else:
+        def new_frame():
+            capture_cache.new_frame()
+            if capture_workers is not None:
+                capture_workers.capture()
+
+        scheduler = OutputScheduler(
+            create_fixture_schedules(pixel_strips, frame_buffer, frame_rate), new_frame=new_frame,
+            render=lambda pixel_strip: img_proc.render_strip(pixel_strip, args.save),
+            send=lambda universes: sender.flush(universes), budget=args.schedule_budget,
+            report_interval=args.stats_interval, on_report=print_stats,
+        )
+        stats.add_source("fixtures", scheduler.stats)
+        # frame_clock never ticks in this mode, report the scheduler's passes instead
+        stats.add_source("clock", scheduler.clock_stats)
+        print(f"per-fixture rates: {scheduler}")
 
 if args.profile:
     for i in range(0, 100):
-        send_data(sender, pixel_strips, save_image=args.save)
-        time.sleep(sleep_time)
-
+        frame_clock.wait()
+        send_data(sender, pixel_strips, capture_cache, save_image=args.save,
+                  frame_buffer=frame_buffer, interpolator=interpolator, capture_workers=capture_workers,
+                  recorder=recorder)
+
+    if capture_workers is not None:
+        capture_workers.close()
+    if recorder is not None:
+        recorder.close()
     sender.stop()
+    diagnostics.close()
     sys.exit(0)
 
 if args.test:
@@ -219,8 +337,34 @@ if args.off:
     strips_off(pixel_strips)
     sys.exit(0)
 
+if args.pipeline:
+    pipeline = Pipeline(pixel_strips, frame_buffer, capture_cache, sender, frame_rate, save_image=args.save,
+                        source_factory=lambda: sources.open_source(args.source), interpolator=interpolator,
+                        recorder=recorder)
+    pipeline.start()
+    while True:
+        time.sleep(args.stats_interval or 1)
+        if args.stats_interval:
+            print(f"pipeline: {pipeline.stats()}")
+            print(stats.report_line())
+
+if scheduler is not None:
+    while True:
+        scheduler.wait()
+        t = time.perf_counter()
+        if scheduler.tick():
+            if recorder is not None:
+                recorder.record_frame()
+            if quality is not None:
+                quality.frame_done(time.perf_counter() - t)
+
 # for i in range(0, 1000):
 while True:
-    send_data(sender, pixel_strips, save_image=args.save)
-    time.sleep(sleep_time)
+    frame_clock.wait()
+    t = time.perf_counter()
+    send_data(sender, pixel_strips, capture_cache, save_image=args.save,
+              frame_buffer=frame_buffer, interpolator=interpolator, capture_workers=capture_workers,
+              recorder=recorder)
+    if quality is not None:
+        quality.frame_done(time.perf_counter() - t)
 
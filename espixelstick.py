@@ -1,19 +1,30 @@
-from typing import List
+from typing import Optional
 
-import sacn
+import numpy as np
 
-from mapping import PixelStrip
+from e131 import E131Sender
+from framebuffer import FrameBuffer
 
 
-def create_sender(pixel_strips: List[PixelStrip], **kwargs):
-    sender = sacn.sACNsender(**kwargs)  # provide an IP-Address to bind to if you are using Windows and want to use multicast
-    sender.start()  # start the sending thread
+# sync_universe: when set, every frame is followed by an E1.31 sync packet so the
+# controllers latch all universes at the same time
+# keepalive / change_threshold: universes that haven't changed are only resent every
+# 'keepalive' seconds, see E131Sender
+#
+# Every universe of the frame buffer gets an output bound to its slice of the buffer, so
+# sender.flush() sends whatever the strips rendered into it.  'buffer' binds the outputs to
+# another array with the same layout instead (e.g. the output of a FrameInterpolator)
+def create_sender(frame_buffer: FrameBuffer, sync_universe: Optional[int] = None,
+                  buffer: Optional[np.ndarray] = None, **kwargs):
+    sender = E131Sender(sync_universe=sync_universe, **kwargs)
 
-    for i, pixel_strip in enumerate(pixel_strips):
-        universe = pixel_strip.universe
-        sender.activate_output(universe)
-        # multicast is not working for whatever reason
-        sender[universe].multicast = False
-        sender[universe].destination = pixel_strip.strip_addr
+    # frames are sent with sender.flush() once all universes have their data
+    sender.manual_flush = True
+
+    universes = frame_buffer.universes if buffer is None else frame_buffer.views(buffer)
+    for universe, data in universes.items():
+        # unicast to each controller, multicast is not working for whatever reason
+        sender.activate_output(universe, frame_buffer.destinations[universe])
+        sender.bind(universe, data)
 
     return sender
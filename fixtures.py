@@ -0,0 +1,91 @@
+import math
+from typing import List
+
+from capture import CaptureCache
+from mapping import PixelAddress, PixelStrip
+from region import ScreenRegion, CombineRegion
+
+### A lot of the code below is very specific to my specific pixel setup.  The setup consists of:
+# LED type: these are SK6812 LEDs which are RGBW.  This is what I already had in channels w/ connectors
+# I would have preferred to use APA102 LEDs but I didn't have them in channels.  The RGBW LEDs require 4 DMX channels per light
+# which reduces the number of LEDs we can have in a DMX Universe.  That's definitely a downside to these LEDs
+# (DMX universes can have 512 lights, and each individual LED is RGBW=4x lights).
+#
+# 3 distinct LED fixtures
+# - each fixture uses 1 esp8266 (dev board)
+#
+# - right monitor
+#   - dmx universe 1
+#   - 4 rows x 29 pixels in horizontal zigzag pattern starting at lower left
+#
+# - left monitor
+#   - dmx universe 2
+#   - 4 rows x 29 pixels in horizontal zigzag pattern starting at lower left
+#
+# - desk
+#   - dmx universe 3+4
+#   - 3 rows, horizontal zigzag, starting at upper right
+#   - row #1 - back of desk, 75 pixels
+#   - row #2 - 71 pixels, 53 in universe 3 and the last 18 in universe 4
+#     - row 2 is split due to universe size limit (the frame buffer takes care of that)
+#   - row #3 - 71 pixels
+#     - row #2 and #3 are in the middle of the desk facing downwards
+#
+# The monitor backlights sit right next to the image, so they get priority over the desk
+# underglow when the scheduler is short on time (see scheduler.py)
+
+# function to determine if a specific pixel falls into a specific region
+# used for the monitors which have 4x rows of 29 pixels each
+# this is how we determine which LEDs should get the top of a screen vs the bottom of a screen
+# this functionality should really be refactored to use the newer ScreenRegion class
+def _region_fn_monitors(pixel: PixelAddress) -> str:
+    if pixel.index < 29*2:
+        return "bottom"
+    else:
+        return "top"
+
+# Builds my desk setup.  universe_offset shifts every universe (used to fake bigger setups
+# in the benchmarks), count only builds the first count strips (the regions of the strips that
+# aren't built never get registered with the capture cache), the rest of the kwargs go to every
+# PixelStrip
+def create_pixel_strips(capture_cache: CaptureCache, universe_offset: int = 0, count: int = 3,
+                        **strip_kwargs) -> List[PixelStrip]:
+    def right_monitor() -> PixelStrip:
+        # 192.168.1.237
+        return PixelStrip(
+            strip_addr="192.168.1.237", universe=universe_offset+1, row_length=[29,29,29,29], rows=4, start_left=True,
+            start_bottom=True, region_fn=_region_fn_monitors,
+            regions=[ScreenRegion("bottom", 3, capture_cache), ScreenRegion("top", 3, capture_cache)],
+            priority=1, **strip_kwargs,
+        )
+
+    def left_monitor() -> PixelStrip:
+        # 192.168.1.240
+        return PixelStrip(
+            strip_addr="192.168.1.240", universe=universe_offset+2, row_length=[29,29,29,29], rows=4, start_left=True,
+            start_bottom=True, region_fn=_region_fn_monitors,
+            regions=[ScreenRegion("bottom", 1, capture_cache), ScreenRegion("top", 1, capture_cache)],
+            priority=1, **strip_kwargs,
+        )
+
+    def desk() -> PixelStrip:
+        # The desk is one strip of 75 + 71 + 71 LEDs = 868 channels, more than fits in a
+        # universe.  It starts at universe 3 and the frame buffer runs it on into universe 4
+        return PixelStrip(
+            strip_addr="192.168.1.243", universe=universe_offset+3, row_length=[75, 71, 71], rows=3, start_left=False,
+            start_bottom=False, region_fn=lambda _: "bottom",
+            regions=[CombineRegion("bottom", 1, capture_cache)], **strip_kwargs,
+        )
+
+    # The list of pixels strips.  The PixelStrip has kind of grown into a catch-all for a bunch of functionality & data
+    return [build() for build in (right_monitor, left_monitor, desk)[:count]]
+
+
+# fixture_count strips for the benchmarks: as many copies of the desk setup as needed (4
+# universes apart), the last copy only as far as it's needed
+def create_fixtures(capture_cache: CaptureCache, fixture_count: int, **strip_kwargs) -> List[PixelStrip]:
+    pixel_strips: List[PixelStrip] = []
+    for i in range(math.ceil(fixture_count / 3)):
+        pixel_strips += create_pixel_strips(capture_cache, universe_offset=i*4,
+                                            count=min(fixture_count - i*3, 3), **strip_kwargs)
+    return pixel_strips
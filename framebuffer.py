@@ -0,0 +1,77 @@
+from typing import Dict, List
+
+import numpy as np
+
+from e131 import DMX_CHANNELS
+from mapping import PixelStrip
+
+# The whole installation's DMX data in one preallocated buffer.
+#
+# Every strip gets a range of channels starting at the beginning of its first universe and
+# its color_data becomes an (n, 4) view into that range, so sampling / color correction write
+# straight into the output and nothing is copied or concatenated per frame.  Universes are
+# 512 channel memoryview slices of the same buffer, so a strip with more than 128 RGBW LEDs
+# just runs on into the next universe(s) (like the desk, 217 LEDs over universes 3 and 4).
+#
+#   frame_buffer = FrameBuffer(pixel_strips)
+#   frame_buffer.universes[4]    # memoryview of channels 512-1023 of the buffer
+
+
+class FrameBuffer:
+    def __init__(self, pixel_strips: List[PixelStrip]):
+        self.pixel_strips = pixel_strips
+        self.first_universe = min(pixel_strip.universe for pixel_strip in pixel_strips)
+
+        # channel range of every strip: (start, stop)
+        self.strip_ranges: Dict[PixelStrip, tuple] = {}
+        end = 0
+        for pixel_strip in pixel_strips:
+            start = (pixel_strip.universe - self.first_universe) * DMX_CHANNELS
+            stop = start + pixel_strip.color_data.size
+            self.strip_ranges[pixel_strip] = (start, stop)
+            end = max(end, stop)
+
+        ranges = sorted(self.strip_ranges.items(), key=lambda item: item[1])
+        for (strip_a, (_, stop_a)), (strip_b, (start_b, _)) in zip(ranges, ranges[1:]):
+            if start_b < stop_a:
+                raise ValueError(f"{strip_a} (universe {strip_a.universe}) runs into {strip_b} (universe {strip_b.universe})")
+
+        universe_count = -(-end // DMX_CHANNELS)
+        self.buffer = np.zeros(universe_count * DMX_CHANNELS, dtype=np.uint8)
+
+        for pixel_strip, (start, stop) in self.strip_ranges.items():
+            pixel_strip.color_data = self.buffer[start:stop].reshape(-1, 4)
+
+        # only universes some strip actually uses, gaps between strips aren't sent
+        self.destinations: Dict[int, str] = {}
+        for pixel_strip in pixel_strips:
+            for universe in self.strip_universes(pixel_strip):
+                self.destinations[universe] = pixel_strip.strip_addr
+        self.universes = self.views(self.buffer)
+
+    def __str__(self):
+        return f"FrameBuffer[universes={sorted(self.universes)},channels={self.buffer.size}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    # Channel offset of a universe in the buffer
+    def offset(self, universe: int) -> int:
+        return (universe - self.first_universe) * DMX_CHANNELS
+
+    # Universe slices of another buffer with the same layout (e.g. a copy of this one)
+    def views(self, buffer: np.ndarray) -> Dict[int, memoryview]:
+        if buffer.shape != self.buffer.shape or buffer.dtype != np.uint8:
+            raise ValueError(f"buffer has to be {self.buffer.size} uint8 channels")
+        view = memoryview(buffer)
+        return {
+            universe: view[self.offset(universe):self.offset(universe) + DMX_CHANNELS]
+            for universe in sorted(self.destinations)
+        }
+
+    def strip_universes(self, pixel_strip: PixelStrip) -> List[int]:
+        start, stop = self.strip_ranges[pixel_strip]
+        return [self.first_universe + i for i in range(start // DMX_CHANNELS, -(-stop // DMX_CHANNELS))]
+
+    def clear(self):
+        self.buffer[:] = 0
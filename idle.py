@@ -0,0 +1,74 @@
+from typing import List, Optional
+
+import numpy as np
+import PIL
+
+from mapping import PixelStrip
+
+# Static screen detection.  Most of the time the screen is a document or a terminal that isn't
+# changing, and grabbing + resizing it 30 times a second just gives the same colors again.
+#
+# Every region gets a ChangeDetector that compares what it captured (the image resized down to
+# the LED grid, which is a sparse sample of the capture already and costs next to nothing to
+# compare) against the last capture.  After 'idle_after' captures without a change the region
+# drops to capturing every 'idle_interval' frames, reusing its last image in between.  The
+# first capture that's different puts it straight back to full rate.
+#
+# All idle regions capture on the same frames, so when everything on a monitor is idle the
+# monitor isn't grabbed at all on the other frames
+
+
+class ChangeDetector:
+    # threshold: largest per-channel difference that still counts as unchanged (capture noise,
+    # dithering, a blinking cursor resized into a whole LED...)
+    def __init__(self, idle_after: int = 60, idle_interval: int = 15, threshold: int = 2):
+        self.idle_after = idle_after
+        self.idle_interval = idle_interval
+        self.threshold = threshold
+
+        self.previous: Optional[np.ndarray] = None
+        self.static_frames = 0
+        self.wakeups = 0
+
+    def __str__(self):
+        return f"ChangeDetector[idle_after={self.idle_after},idle_interval={self.idle_interval},threshold={self.threshold}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def idle(self) -> bool:
+        return self.static_frames >= self.idle_after
+
+    # Frames between captures right now
+    def interval(self) -> int:
+        return self.idle_interval if self.idle else 1
+
+    # Compare a new capture with the last one.  Returns True if it changed
+    def update(self, img: PIL.Image.Image) -> bool:
+        current = np.asarray(img)
+        previous = self.previous
+        self.previous = current
+
+        if previous is None or previous.shape != current.shape:
+            changed = True
+        elif self.threshold <= 0:
+            changed = not np.array_equal(previous, current)
+        else:
+            changed = bool(np.any(np.abs(current.astype(np.int16) - previous) > self.threshold))
+
+        if changed:
+            if self.idle:
+                self.wakeups += 1
+            self.static_frames = 0
+        else:
+            self.static_frames += 1
+        return changed
+
+
+# Give every region of the strips its own detector.  idle_after <= 0 turns detection off
+def enable_idle_detection(pixel_strips: List[PixelStrip], idle_after: int, idle_interval: int, threshold: int = 2):
+    regions = {region: None for pixel_strip in pixel_strips for region in pixel_strip.regions}
+    for region in regions:
+        region.change_detector = ChangeDetector(idle_after, idle_interval, threshold) if idle_after > 0 else None
+    return list(regions)
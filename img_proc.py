@@ -3,17 +3,17 @@ import logging
 from pprint import pprint
 from typing import List, Dict
 
+import numpy as np
 import PIL
 from PIL import Image
 import time
 import sys
 
-import mss
-from mss import models
-from mss.screenshot import ScreenShot
-
+import diagnostics
 import espixelstick
-from mapping import PixelAddress, PixelStrip
+import stats
+from mapping import PixelAddress, PixelStrip, SamplePlan
+from pyramid import summed_area_table
 from region import ScreenRegion
 
 # def get_combined_bounding_box(region1: str, monitor1: mss.models.Monitor, region2: str, monitor2: mss.models.Monitor):
@@ -21,24 +21,70 @@ from region import ScreenRegion
 #     bb2 = get_bounding_box(region2, monitor2)
 #
 
-# we just loop over the image in the same pattern as the LEDs are configured
-def create_color_data(img: PIL.Image, pixel_strip: PixelStrip, region: ScreenRegion) -> List[int]:
-    color_data = []
-
-    # replace this with a loop thru an iterator of the Pixels
-
-    for pixel in iter(pixel_strip.get_pixels_for_region(region)):
-        # print(f"getting data for pixel: {pixel.x},{pixel.y}")
-        try:
-            r, g, b = img.getpixel((pixel.x, pixel.y))
-        except IndexError as e:
-            print(f"ERROR GETTING PIXEL: {pixel.x}, {pixel.y}")
-            print(str(e))
-            img.save(f"saved-images/error-log-{region.name}.png")
-            raise
-        color_data.append(r)
-        color_data.append(g)
-        color_data.append(b)
-        color_data.append(0) # white - should I avg this?
+# Average color of the area each LED covers
+def sample_area(arr: np.ndarray, plan: SamplePlan) -> np.ndarray:
+    h, w = arr.shape[:2]
+    sat = summed_area_table(arr)
+
+    # footprint of each LED in image pixels, at least 1x1
+    x0 = np.floor(plan.u0 * w).astype(np.intp)
+    y0 = np.floor(plan.v0 * h).astype(np.intp)
+    x1 = np.maximum(np.ceil(plan.u1 * w).astype(np.intp), x0 + 1)
+    y1 = np.maximum(np.ceil(plan.v1 * h).astype(np.intp), y0 + 1)
+
+    # uint32 wraps around, but the 4 corner sum still comes out right
+    total = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+    area = ((x1 - x0) * (y1 - y0))[:, None]
+    return (total + area // 2) // area
+
+# we gather the color for every LED of the region at once, using the mapping compiled
+# when the PixelStrip was created.  Writes into pixel_strip.color_data and returns the
+# slice for this region
+def create_color_data(img: PIL.Image, pixel_strip: PixelStrip, region: ScreenRegion) -> np.ndarray:
+    plan = pixel_strip.sample_plans[region.name]
+    color_data = pixel_strip.color_data[plan.start:plan.stop]
+    arr = np.asarray(img)
+
+    try:
+        if pixel_strip.sampling == "area":
+            color_data[:, :3] = sample_area(arr, plan)
+        else:
+            color_data[:, :3] = arr[plan.ys, plan.xs]
+    except IndexError as e:
+        print(f"ERROR GETTING PIXELS: image size {img.size}, plan {plan}")
+        print(str(e))
+        diagnostics.tap(f"error-log-{region.name}", img, force=True)
+        raise
+    # white stays 0 - should I avg this?
 
     return color_data
+
+# Pyramid sampling: no resized image, the region samples every LED's footprint out of the
+# monitor pyramids
+def sample_pyramid(pixel_strip: PixelStrip, region: ScreenRegion) -> np.ndarray:
+    plan = pixel_strip.sample_plans[region.name]
+    color_data = pixel_strip.color_data[plan.start:plan.stop]
+    color_data[:, :3] = region.sample_leds(plan)
+    return color_data
+
+# Capture every region of the strip and fill in pixel_strip.color_data
+def render_strip(pixel_strip: PixelStrip, save_image: bool) -> np.ndarray:
+    img_x, img_y = pixel_strip.sample_size()
+    for region in pixel_strip.regions:
+        if pixel_strip.sampling == "pyramid":
+            t = time.perf_counter()
+            sample_pyramid(pixel_strip, region)
+            stats.record("sample", time.perf_counter() - t)
+            continue
+
+        img = region.capture_and_resize(img_x, img_y, save_image)
+        t = time.perf_counter()
+        create_color_data(img, pixel_strip, region)
+        stats.record("sample", time.perf_counter() - t)
+
+    if pixel_strip.color_transform is not None:
+        t = time.perf_counter()
+        pixel_strip.color_transform.apply(pixel_strip.color_data)
+        stats.record("color", time.perf_counter() - t)
+
+    return pixel_strip.color_data
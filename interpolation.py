@@ -0,0 +1,101 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+# Capture the screen at a low rate and send to the LEDs at a high one.  Grabbing and resizing
+# screenshots is what costs the CPU, but how smooth the LEDs look depends on how often they're
+# updated, so in between captures the output is interpolated from the captured frames.
+#
+# Works on the whole frame buffer at once (every channel of every universe), all the math is
+# done in place in preallocated float32 arrays.
+#
+# mode:
+# - "linear": fade from where the LEDs are to the newest capture over one capture period.  Smooth
+#   fades, but the LEDs reach a new capture one capture period later than they would otherwise
+# - "ema": every output frame moves part of the way to the newest capture (exponential moving
+#   average with a time constant of 'smoothing' seconds).  Reacts right away, but a fast
+#   flash never quite reaches full brightness
+#
+#   interpolator = FrameInterpolator(frame_buffer.buffer.size, capture_fps=10)
+#   if interpolator.capture_due(now):
+#       ... render into frame_buffer ...
+#       interpolator.update(frame_buffer.buffer, now)
+#   interpolator.step(now)    # -> interpolator.output, which the sender is bound to
+
+MODES = ("linear", "ema")
+
+
+class FrameInterpolator:
+    def __init__(self, size: int, capture_fps: float, mode: str = "linear", smoothing: float = 0.1):
+        if mode not in MODES:
+            raise ValueError(f"unknown interpolation mode: {mode}")
+        self.mode = mode
+        self.capture_fps = capture_fps
+        self.capture_period = 1 / capture_fps
+        self.smoothing = smoothing
+
+        self.start = np.zeros(size, dtype=np.float32)
+        self.target = np.zeros(size, dtype=np.float32)
+        self.current = np.zeros(size, dtype=np.float32)
+        self.scratch = np.zeros(size, dtype=np.float32)
+        self.output = np.zeros(size, dtype=np.uint8)
+
+        self.next_capture: Optional[float] = None
+        self.updated_at: Optional[float] = None
+        self.fade_time = self.capture_period
+        self.stepped_at: Optional[float] = None
+
+    def __str__(self):
+        return f"FrameInterpolator[mode={self.mode},capture_fps={self.capture_fps:g},smoothing={self.smoothing:g}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    # Whether it's time to capture a new frame.  Captures are scheduled against absolute
+    # deadlines like FrameClock, a late capture doesn't push the ones after it back
+    def capture_due(self, now: float) -> bool:
+        if self.next_capture is None:
+            self.next_capture = now
+        if now < self.next_capture:
+            return False
+        self.next_capture += self.capture_period
+        if self.next_capture <= now:
+            self.next_capture = now + self.capture_period
+        return True
+
+    # A new captured frame (uint8, same layout as the output)
+    def update(self, frame: np.ndarray, now: float):
+        if self.updated_at is None:
+            # nothing to fade from yet, jump straight to the first frame
+            self.current[:] = frame
+        else:
+            # fade over however long the last capture took to arrive, so a late capture
+            # doesn't leave the LEDs sitting still waiting for it
+            self.fade_time = min(max(now - self.updated_at, 1e-3), 2 * self.capture_period)
+        self.start[:] = self.current
+        self.target[:] = frame
+        self.updated_at = now
+
+    # Advance the output to 'now'.  Returns the output buffer
+    def step(self, now: float) -> np.ndarray:
+        if self.updated_at is None:
+            return self.output
+
+        if self.mode == "linear":
+            t = min((now - self.updated_at) / self.fade_time, 1.0)
+            np.subtract(self.target, self.start, out=self.scratch)
+            self.scratch *= t
+            np.add(self.start, self.scratch, out=self.current)
+        else:
+            dt = now - self.stepped_at if self.stepped_at is not None else 0.0
+            alpha = 1.0 - math.exp(-dt / self.smoothing) if self.smoothing > 0 else 1.0
+            np.subtract(self.target, self.current, out=self.scratch)
+            self.scratch *= alpha
+            self.current += self.scratch
+        self.stepped_at = now
+
+        # round to the nearest channel value
+        np.add(self.current, 0.5, out=self.scratch)
+        np.copyto(self.output, self.scratch, casting="unsafe")
+        return self.output
@@ -0,0 +1,311 @@
+import argparse
+import json
+import multiprocessing
+import selectors
+import socket
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import espixelstick
+import fixtures
+import planner
+from capture import CaptureCache
+from e131 import (ACN_SDT_MULTICAST_PORT, DATA_OFFSET, SEQUENCE_OFFSET, VECTOR_ROOT_E131_DATA,
+                  VECTOR_ROOT_E131_EXTENDED)
+from framebuffer import FrameBuffer
+from mapping import SAMPLING_MODES
+from pipeline import send_data
+from scheduler import FrameClock
+from sources import Frame, FrameSource, side_by_side_monitors
+
+# End to end output timing without any controllers.  Every fixture gets a fake ESPixelStick:
+# a UDP sACN receiver on its own loopback address (127.0.0.2, 127.0.0.3, ... in place of the
+# 192.168.1.x addresses in fixtures.py), and send_data is driven from a frame source that
+# fills the screen with a marker color encoding the frame number.  The marker survives the
+# resize and sampling (it's a solid color), so the receivers can tell which frame every packet
+# belongs to and we get:
+#
+# - latency: from the first grab of a frame to its packet arriving, per universe
+# - jitter: how much the time between packets of a universe varies
+# - sequence gaps: E1.31 sequence numbers that never arrived (or arrived out of order)
+# - skew: spread between the first and last universe of the same frame arriving
+#
+#   python loopback.py                                     # my 3 fixtures, universes 1-4
+#   python loopback.py --fixtures 64 --sync-universe 999   # a lot of controllers, with sync
+#
+# The receivers run in their own process so they aren't fighting the draw loop for the GIL.
+# time.perf_counter is the system wide monotonic clock on linux, so the timestamps of both
+# processes can be compared.  Linux answers on all of 127.0.0.0/8, elsewhere the extra
+# loopback addresses may need to be added first
+
+# Marker: red / green are the frame number, blue is a fixed tag so a black or stale frame
+# isn't mistaken for a marker
+MARKER_TAG = 0xa5
+MARKER_FRAMES = 1 << 16
+
+
+def marker_color(frame_no: int) -> Tuple[int, int, int]:
+    frame_no %= MARKER_FRAMES
+    return frame_no & 0xff, frame_no >> 8, MARKER_TAG
+
+
+# Frame number of an RGB(W) LED, None if it isn't a marker
+def decode_marker(rgb: bytes) -> Optional[int]:
+    if len(rgb) < 3 or rgb[2] != MARKER_TAG:
+        return None
+    return rgb[0] | (rgb[1] << 8)
+
+
+# The whole screen is one marker color, next_frame() moves on to the next one.  The capture
+# time of a frame is when it was first grabbed
+class MarkerSource(FrameSource):
+    def __init__(self, width: int = 1920, height: int = 1080, monitor_count: int = 3):
+        self.monitors = side_by_side_monitors(width * monitor_count, height, monitor_count)
+        self.frame_no = -1
+        self.bgra = np.zeros(4, dtype=np.uint8)
+        self.captured_at: Dict[int, float] = {}
+
+    def next_frame(self) -> int:
+        self.frame_no += 1
+        red, green, blue = marker_color(self.frame_no)
+        self.bgra[:] = (blue, green, red, 255)
+        return self.frame_no
+
+    def grab(self, bb):
+        left, top, right, bottom = bb
+        self.captured_at.setdefault(self.frame_no % MARKER_FRAMES, time.perf_counter())
+        pixels = np.empty((bottom - top, right - left, 4), dtype=np.uint8)
+        pixels[:] = self.bgra
+        return Frame((right - left, bottom - top), pixels.tobytes())
+
+
+# Receiver process: listens on every address until told to stop, then sends back what arrived.
+# Data packets are (time, address, universe, sequence, marker), sync packets
+# (time, address, sync universe, sequence, None) with the universe negated
+def _receive(addresses: List[str], port: int, conn, ready):
+    selector = selectors.DefaultSelector()
+    sockets = []
+    for address in addresses:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        sock.bind((address, port))
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, address)
+        sockets.append(sock)
+    selector.register(conn, selectors.EVENT_READ, None)
+    ready.set()
+
+    packets = []
+    running = True
+    while running:
+        for key, _ in selector.select():
+            if key.data is None:
+                conn.recv()
+                running = False
+                continue
+            while True:
+                try:
+                    packet = key.fileobj.recv(1024)
+                except BlockingIOError:
+                    break
+                now = time.perf_counter()
+                vector = int.from_bytes(packet[18:22], "big")
+                if vector == VECTOR_ROOT_E131_DATA and len(packet) >= DATA_OFFSET + 3:
+                    universe = int.from_bytes(packet[113:115], "big")
+                    packets.append((now, key.data, universe, packet[SEQUENCE_OFFSET],
+                                    decode_marker(packet[DATA_OFFSET:DATA_OFFSET + 3])))
+                elif vector == VECTOR_ROOT_E131_EXTENDED and len(packet) >= 47:
+                    packets.append((now, key.data, -int.from_bytes(packet[45:47], "big"), packet[44], None))
+
+    conn.send(packets)
+    for sock in sockets:
+        sock.close()
+
+
+class LoopbackReceivers:
+    def __init__(self, addresses: List[str], port: int = ACN_SDT_MULTICAST_PORT):
+        self.addresses = addresses
+        self.port = port
+        context = multiprocessing.get_context("fork")
+        self.conn, child = context.Pipe()
+        ready = context.Event()
+        self.process = context.Process(target=_receive, args=(addresses, port, child, ready),
+                                       name="loopback-receivers", daemon=True)
+        self.process.start()
+        if not ready.wait(timeout=5):
+            self.process.terminate()
+            raise RuntimeError(f"loopback receivers didn't start (can {addresses[0]}:{port} be bound?)")
+
+    def __str__(self):
+        return f"LoopbackReceivers[{len(self.addresses)} addresses,port={self.port}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    # Stop listening and return every packet that arrived
+    def stop(self) -> List[Tuple]:
+        self.conn.send(None)
+        packets = self.conn.recv()
+        self.process.join(timeout=1)
+        return packets
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    arr = np.array(values) * 1000
+    return {
+        "p50": float(np.percentile(arr, 50)),
+        "p90": float(np.percentile(arr, 90)),
+        "p99": float(np.percentile(arr, 99)),
+        "max": float(arr.max()),
+    }
+
+
+# Sequence numbers that were skipped (and ones that went backwards) in a universe's packets
+def sequence_gaps(sequences: List[int]) -> Tuple[int, int]:
+    missing = 0
+    out_of_order = 0
+    for previous, sequence in zip(sequences, sequences[1:]):
+        step = (sequence - previous) & 0xff
+        # E1.31 6.7.2: a step of -20..0 is an old (out of order / duplicate) packet
+        if step == 0 or step >= 256 - 20:
+            out_of_order += 1
+        else:
+            missing += step - 1
+    return missing, out_of_order
+
+
+def analyze(packets: List[Tuple], captured_at: Dict[int, float], universes: List[int], frames: int) -> Dict:
+    by_universe: Dict[int, List[Tuple]] = {universe: [] for universe in universes}
+    syncs = []
+    for packet in packets:
+        if packet[2] < 0:
+            syncs.append(packet)
+        elif packet[2] in by_universe:
+            by_universe[packet[2]].append(packet)
+
+    result = {"frames": frames, "universes": {}, "syncs": len(syncs)}
+    arrivals: Dict[int, List[float]] = {}
+    all_latencies = []
+    for universe, received in by_universe.items():
+        received.sort()
+        times = [packet[0] for packet in received]
+        latencies = []
+        for now, _, _, _, marker in received:
+            if marker is not None and marker in captured_at:
+                latencies.append(now - captured_at[marker])
+                arrivals.setdefault(marker, []).append(now)
+        all_latencies += latencies
+
+        intervals = np.diff(times) if len(times) > 1 else np.zeros(0)
+        missing, out_of_order = sequence_gaps([packet[3] for packet in received])
+        result["universes"][universe] = {
+            "packets": len(received),
+            "latency_ms": percentiles(latencies),
+            "interval_ms": float(intervals.mean() * 1000) if len(intervals) else 0.0,
+            "jitter_ms": float(intervals.std() * 1000) if len(intervals) else 0.0,
+            "missing": missing,
+            "out_of_order": out_of_order,
+        }
+
+    # frames every universe got, and how far apart their packets arrived
+    complete = [times for times in arrivals.values() if len(times) == len(universes)]
+    result["latency_ms"] = percentiles(all_latencies)
+    result["complete_frames"] = len(complete)
+    result["skew_ms"] = percentiles([max(times) - min(times) for times in complete])
+    return result
+
+
+def print_result(result: Dict):
+    latency = result["latency_ms"]
+    skew = result["skew_ms"]
+    print(f"{result['frames']} frames sent, {result['complete_frames']} arrived on every universe, "
+          f"{result['syncs']} sync packets")
+    print(f"  capture to wire: p50 {latency['p50']:6.2f}ms p90 {latency['p90']:6.2f}ms "
+          f"p99 {latency['p99']:6.2f}ms max {latency['max']:6.2f}ms")
+    print(f"  universe skew:   p50 {skew['p50']:6.2f}ms p90 {skew['p90']:6.2f}ms "
+          f"p99 {skew['p99']:6.2f}ms max {skew['max']:6.2f}ms")
+    for universe, stats in sorted(result["universes"].items()):
+        latency = stats["latency_ms"]
+        print(f"  universe {universe:4}: {stats['packets']:6} packets, latency p50 {latency['p50']:6.2f}ms "
+              f"p99 {latency['p99']:6.2f}ms, interval {stats['interval_ms']:6.2f}ms jitter {stats['jitter_ms']:5.2f}ms, "
+              f"missing {stats['missing']}, out of order {stats['out_of_order']}")
+
+
+# Same fixtures as bench.py (my 3 fixture desk setup repeated on new universes), every fixture
+# sending to its own loopback address
+def create_setup(source: MarkerSource, fixture_count: int, sampling: str, capture_density: int,
+                 **sender_kwargs):
+    capture_cache = CaptureCache(source, pyramid=sampling == "pyramid")
+    pixel_strips = fixtures.create_fixtures(capture_cache, fixture_count, sampling=sampling)
+    if capture_density > 0:
+        planner.plan_capture(pixel_strips, capture_density)
+
+    frame_buffer = FrameBuffer(pixel_strips)
+    for i, pixel_strip in enumerate(pixel_strips):
+        for universe in frame_buffer.strip_universes(pixel_strip):
+            frame_buffer.destinations[universe] = f"127.0.0.{i + 2}"
+    sender = espixelstick.create_sender(frame_buffer, **sender_kwargs)
+
+    return capture_cache, pixel_strips, frame_buffer, sender
+
+
+def run(fixture_count: int = 3, frames: int = 300, fps: float = 30, sampling: str = "point",
+        capture_density: int = 16, sync_universe: Optional[int] = None, port: int = ACN_SDT_MULTICAST_PORT) -> Dict:
+    source = MarkerSource()
+    capture_cache, pixel_strips, frame_buffer, sender = create_setup(
+        source, fixture_count, sampling, capture_density, sync_universe=sync_universe, port=port, keepalive=0,
+    )
+
+    receivers = LoopbackReceivers(sorted(set(frame_buffer.destinations.values())), port)
+    clock = FrameClock(fps, report_interval=0)
+    try:
+        for _ in range(frames):
+            clock.wait()
+            source.next_frame()
+            send_data(sender, pixel_strips, capture_cache, save_image=False, frame_buffer=frame_buffer)
+        # before the drain below, or it counts as frame time
+        achieved_fps = clock.achieved_fps()
+        # let the last packets land
+        time.sleep(0.2)
+    finally:
+        packets = receivers.stop()
+        sender.socket.close()
+
+    result = analyze(packets, source.captured_at, sorted(frame_buffer.destinations), frames)
+    result.update({"fixtures": fixture_count, "fps": fps, "achieved_fps": achieved_fps,
+                   "sampling": sampling, "sync_universe": sync_universe})
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='esp-bloom end to end output timing over loopback')
+    parser.add_argument('--fixtures', dest='fixtures', action='store', type=int, default=3, help='number of fixtures (my 3 fixture setup repeated)')
+    parser.add_argument('--frames', dest='frames', action='store', type=int, default=300, help='frames to send')
+    parser.add_argument('--fps', dest='fps', action='store', type=float, default=30, help='target frames per second')
+    parser.add_argument('--sampling', dest='sampling', action='store', default='point', choices=SAMPLING_MODES, help='LED sampling mode')
+    parser.add_argument('--capture-density', dest='capture_density', action='store', type=int, default=16, help='screen lines captured per row of LEDs (0 to capture the whole region)')
+    parser.add_argument('--sync-universe', dest='sync_universe', action='store', type=int, default=None, help='send E1.31 sync packets on this universe')
+    parser.add_argument('--port', dest='port', action='store', type=int, default=ACN_SDT_MULTICAST_PORT, help='UDP port of the receivers')
+    parser.add_argument('--output', dest='output', action='store', default=None, help='save the results to this json file')
+    args = parser.parse_args(argv)
+
+    if args.fixtures > 250:
+        parser.error("at most 250 fixtures")
+
+    result = run(args.fixtures, args.frames, args.fps, args.sampling, args.capture_density, args.sync_universe, args.port)
+    print(f"{result['fixtures']} fixtures at {result['achieved_fps']:.1f}/{args.fps:g} fps")
+    print_result(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created": time.time(), "python": sys.version, "result": result}, f, indent=2)
+        print(f"saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,17 @@
 # Pixel address:
 # - strip # (dmx universe, etc, eventually)
 # - LED # (on the strip)
-from typing import List, Callable, Optional, Union
+from typing import List, Callable, Optional, Union, Dict
 
+import numpy as np
+
+from color import ColorTransform
 from region import ScreenRegion
 
 
+SAMPLING_MODES = ("point", "area", "pyramid")
+
+
 class PixelAddress:
     def __init__(self, strip_addr: str, index: int, x: int, y: int, region: Optional[str] = None):
         self.index = index
@@ -24,12 +30,62 @@ class PixelAddress:
     def __repr__(self):
         return self.__str__()
 
+# The compiled form of the pixel mapping for one region of a strip.  Instead of walking a list
+# of PixelAddress objects every frame we keep flat arrays we can hand straight to numpy
+class SamplePlan:
+    def __init__(self, region_name: str, pixels: List[PixelAddress], start: int, width: int, height: int,
+                 row_widths: Optional[Dict[int, int]] = None):
+        self.region_name = region_name
+
+        # where this region's pixels go in the strip's color data
+        self.start = start
+        self.stop = start + len(pixels)
+
+        # image coordinates of each LED (point sampling)
+        self.xs = np.array([pixel.x for pixel in pixels], dtype=np.intp)
+        self.ys = np.array([pixel.y for pixel in pixels], dtype=np.intp)
+
+        # the area each LED covers, in normalized (0-1) image coordinates (area sampling).
+        # each LED owns one cell of the width x height grid
+        self.u0 = self.xs / width
+        self.v0 = self.ys / height
+        self.u1 = (self.xs + 1) / width
+        self.v1 = (self.ys + 1) / height
+
+        # same, but every row is stretched over the full width of the region no matter how many
+        # LEDs it has (pyramid sampling).  On the desk the 71 LED rows cover the same stretch of
+        # screen as the 75 LED one
+        widths = np.array([row_widths.get(pixel.y, width) if row_widths else width for pixel in pixels], dtype=np.float64)
+        self.nu0 = self.xs / widths
+        self.nu1 = (self.xs + 1) / widths
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __str__(self):
+        return f"SamplePlan[{self.region_name},start={self.start},stop={self.stop}]"
+
+    def __repr__(self):
+        return self.__str__()
+
 class PixelStrip:
+    # sampling:
+    # - "point": resize the region down to the LED grid and take 1 pixel per LED
+    # - "area": resize the region to area_oversample x the LED grid and average the whole cell
+    #   each LED covers (summed-area table, so it's O(1) per LED)
+    # - "pyramid": no resize, every LED averages its footprint on the screen out of the monitor's
+    #   box-filtered pyramid (pyramid.py, needs a CaptureCache with pyramid=True)
+    #
+    # fps / priority: this fixture's own update rate (None = the global frame rate) and its
+    # priority when the OutputScheduler is short on time (higher goes first, see scheduler.py)
     def __init__(self, strip_addr: str, universe: int,
                  row_length: Union[int, List[int]], rows: int, start_left: bool,
                  start_bottom: bool, region_fn: Callable[[PixelAddress], str],
                  regions: List[ScreenRegion],
                  first_pixel_offset: int = 0, max_row_length: Optional[int] = None,
+                 sampling: str = "point", area_oversample: int = 4,
+                 color_transform: Optional[ColorTransform] = None,
+                 fps: Optional[float] = None, priority: int = 0,
         ):
 
         # Keep track of max row length to avoid index out of bound issues
@@ -49,8 +105,26 @@ class PixelStrip:
         self.regions = regions
         self.first_pixel_offset = first_pixel_offset
 
+        if sampling not in SAMPLING_MODES:
+            raise ValueError(f"unknown sampling mode: {sampling}")
+        self.sampling = sampling
+        self.area_oversample = area_oversample
+
+        # gamma / white extraction / brightness for this fixture, applied after sampling
+        self.color_transform = color_transform
+
+        self.fps = fps
+        self.priority = priority
+
         self.pixels = self.generate_pixel_mapping(start_left, start_bottom)
 
+        # Compile the mapping once so the draw loop only does array gathers
+        self.sample_plans = self.compile_sample_plans()
+
+        # RGBW output for the strip, filled in place every frame.  A FrameBuffer swaps this
+        # for a view into the installation's buffer
+        self.color_data = np.zeros((sum(len(plan) for plan in self.sample_plans.values()), 4), dtype=np.uint8)
+
     def __str__(self):
         return f"PixelStrip[{self.strip_addr},row_length={self.row_length},rows={self.rows},y={self.start_left},start_bottom={self.start_bottom}]"
 
@@ -63,6 +137,29 @@ class PixelStrip:
         # print(res)
         return res
 
+    # Size of the image each region should be resized to before we sample it
+    def sample_size(self):
+        if self.sampling == "area":
+            return self.max_row_length * self.area_oversample, self.rows * self.area_oversample
+        return self.max_row_length, self.rows
+
+    # Color data is laid out region by region in the order of self.regions, same as
+    # the order we send it to the strip in
+    def compile_sample_plans(self) -> Dict[str, SamplePlan]:
+        # how many LEDs wide each row is
+        row_widths: Dict[int, int] = {}
+        for pixel in self.pixels:
+            row_widths[pixel.y] = max(row_widths.get(pixel.y, 0), pixel.x + 1)
+
+        plans = {}
+        start = 0
+        for region in self.regions:
+            pixels = self.get_pixels_for_region(region)
+            plans[region.name] = SamplePlan(region.name, pixels, start, self.max_row_length, self.rows, row_widths)
+            start += len(pixels)
+
+        return plans
+
     # Generates a list of 'Pixel' objects that correspond to a pixel on a strip
     # The order of the list corresponds to the order of the pixels on the led strip
     # Each pixel knows its own X, Y coordinate in the grid (horizontal zigzag pattern)
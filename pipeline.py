@@ -0,0 +1,292 @@
+import queue
+import threading
+import time
+from typing import List, Callable, Dict, Any, Optional
+
+import numpy as np
+
+from capture import CaptureCache
+from e131 import DMX_CHANNELS
+from framebuffer import FrameBuffer
+from interpolation import FrameInterpolator
+from recording import Recorder
+from workers import CaptureWorkers
+from mapping import PixelStrip
+from scheduler import FrameClock
+from sources import FrameSource, MssSource
+import img_proc
+import stats
+
+
+# The single threaded draw loop, one frame per call: capture, render every strip into the
+# frame buffer and send it.
+#
+# With an interpolator the screen is only captured when a capture is due, the frames in
+# between are interpolated (the sender is bound to the interpolator's output then)
+#
+# With capture workers every monitor is grabbed and resized in its own process, in parallel
+#
+# With a recorder every frame that's sent is also appended to the recording
+def send_data(sender, pixel_strips: List[PixelStrip], capture_cache: CaptureCache, save_image,
+              frame_buffer: Optional[FrameBuffer] = None, interpolator: Optional[FrameInterpolator] = None,
+              capture_workers: Optional[CaptureWorkers] = None, recorder: Optional[Recorder] = None):
+    frame_start = time.perf_counter()
+    if interpolator is None or interpolator.capture_due(frame_start):
+        # Throw away last frame's screenshots, each monitor gets grabbed once for this frame
+        capture_cache.new_frame()
+        if capture_workers is not None:
+            capture_workers.capture()
+
+        # The strips render straight into the frame buffer the sender's universes are bound to
+        for pixel_strip in pixel_strips:
+            img_proc.render_strip(pixel_strip, save_image)
+
+        if interpolator is not None:
+            interpolator.update(frame_buffer.buffer, time.perf_counter())
+
+    if interpolator is not None:
+        t = time.perf_counter()
+        interpolator.step(t)
+        stats.record("interpolate", time.perf_counter() - t)
+
+    # Send all universes at the same time
+    t = time.perf_counter()
+    sender.flush()
+    stats.record("send", time.perf_counter() - t)
+    if recorder is not None:
+        recorder.record_frame()
+    stats.record("frame", time.perf_counter() - frame_start)
+
+
+# A queue that only holds 1 item.  Putting a new item replaces the one that's there, so
+# whoever reads it always gets the newest frame ("latest frame wins") and a slow consumer
+# never builds up a backlog of stale frames
+class LatestSlot:
+    def __init__(self, name: str):
+        self.name = name
+        self.cond = threading.Condition()
+        self.item = None
+        self.version = 0
+
+        # number of items that were replaced before anyone read them
+        self.dropped = 0
+        self.read_version = 0
+
+    # Returns the item that got replaced before anyone read it (None if it was read)
+    def put(self, item):
+        with self.cond:
+            replaced = None
+            if self.version != self.read_version:
+                self.dropped += 1
+                replaced = self.item
+            self.item = item
+            self.version += 1
+            self.cond.notify_all()
+            return replaced
+
+    # Block until there's an item we haven't read yet
+    def get(self, timeout: Optional[float] = None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.version != self.read_version, timeout):
+                return None
+            self.read_version = self.version
+            return self.item
+
+    # True when there's an item we haven't read yet
+    def unread(self) -> bool:
+        with self.cond:
+            return self.version != self.read_version
+
+    # Newest item without waiting (may be one we've already read)
+    def latest(self):
+        with self.cond:
+            self.read_version = self.version
+            return self.item
+
+
+# Runs capture / process / transmit as separate threads connected by LatestSlots, so each
+# stage works on the next frame while the stage after it is still busy with the previous one.
+# The frame rate ends up limited by the slowest stage instead of the sum of all of them.
+#
+# - capture: 1 thread per monitor, each with its own frame source, grabbing at the target fps
+# - process: waits for new screenshots, resizes them and renders the strips into the frame buffer
+# - transmit: hands the finished frame to the E1.31 sender.  With an interpolator the capture
+#   threads run at the interpolator's capture rate and the transmit thread sends interpolated
+#   frames at the full fps on its own clock
+#
+# The numpy/PIL/mss calls in the stages release the GIL so the threads actually overlap
+class Pipeline:
+    def __init__(self, pixel_strips: List[PixelStrip], frame_buffer: FrameBuffer, capture_cache: CaptureCache,
+                 sender, fps: float, save_image: bool = False, source_factory: Callable[[], FrameSource] = MssSource,
+                 interpolator: Optional[FrameInterpolator] = None, recorder: Optional[Recorder] = None):
+        self.pixel_strips = pixel_strips
+        self.frame_buffer = frame_buffer
+        self.capture_cache = capture_cache
+        self.sender = sender
+        self.fps = fps
+        self.save_image = save_image
+        self.source_factory = source_factory
+        self.interpolator = interpolator
+        self.recorder = recorder
+        self.capture_fps = interpolator.capture_fps if interpolator is not None else fps
+
+        self.running = False
+        self.threads: List[threading.Thread] = []
+
+        self.capture_slots: Dict[int, LatestSlot] = {
+            monitor_no: LatestSlot(f"capture-{monitor_no}") for monitor_no in capture_cache.capture_boxes
+        }
+        # set whenever any capture thread has a new screenshot
+        self.new_capture = threading.Event()
+        self.output_slot = LatestSlot("output")
+
+        # Finished frames are copied out of the frame buffer so the transmit thread isn't reading
+        # it while the next frame gets rendered.  A snapshot belongs to whoever took it off the
+        # free list until they put it back: the process thread while writing it, output_slot while
+        # it waits there (a replaced one goes straight back) and the transmit thread until the
+        # data is copied into the sender.  So 3 are enough and a snapshot is never written while
+        # it's being sent
+        self.free_snapshots: queue.Queue = queue.Queue()
+        for _ in range(3):
+            self.free_snapshots.put(np.zeros_like(frame_buffer.buffer))
+
+        self.frames_processed = 0
+        self.frames_sent = 0
+
+    def start(self):
+        self.running = True
+        for monitor_no in self.capture_slots:
+            self.threads.append(threading.Thread(target=self.capture_loop, args=(monitor_no,), name=f"capture-{monitor_no}", daemon=True))
+        self.threads.append(threading.Thread(target=self.process_loop, name="process", daemon=True))
+        self.threads.append(threading.Thread(target=self.transmit_loop, name="transmit", daemon=True))
+
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        self.new_capture.set()
+        for thread in self.threads:
+            thread.join(timeout=1)
+        self.threads = []
+
+    def capture_loop(self, monitor_no: int):
+        source = self.source_factory()
+        clock = FrameClock(self.capture_fps, report_interval=0)
+        slot = self.capture_slots[monitor_no]
+
+        while self.running:
+            clock.wait()
+            images = self.capture_cache.grab(monitor_no, source)
+            slot.put((time.perf_counter(), images))
+            self.new_capture.set()
+        source.close()
+
+    # Renders once per capture round: when every monitor has a new screenshot.  Rendering on
+    # every single screenshot would render up to (monitors x fps) times and send frames where
+    # only one monitor is new.  A monitor that falls behind holds the round up for at most a
+    # capture period, after that the others go ahead with its last screenshot
+    def process_loop(self):
+        period = 1 / self.capture_fps
+        round_start = None
+        while self.running:
+            timeout = 0.5 if round_start is None else max(round_start + period - time.perf_counter(), 0)
+            if self.new_capture.wait(timeout=timeout):
+                self.new_capture.clear()
+
+            unread = [slot.unread() for slot in self.capture_slots.values()]
+            if not any(unread):
+                round_start = None
+                continue
+            if round_start is None:
+                round_start = time.perf_counter()
+            if not all(unread) and time.perf_counter() - round_start < period:
+                continue
+            round_start = None
+
+            # Use the newest screenshot of every monitor.  Wait until every monitor has
+            # been captured at least once
+            captures = {monitor_no: slot.latest() for monitor_no, slot in self.capture_slots.items()}
+            if any(capture is None for capture in captures.values()):
+                continue
+
+            t = time.perf_counter()
+            self.capture_cache.new_frame()
+            for monitor_no, (_, images) in captures.items():
+                self.capture_cache.store(monitor_no, images)
+
+            for pixel_strip in self.pixel_strips:
+                img_proc.render_strip(pixel_strip, self.save_image)
+            frame = self.free_snapshots.get()
+            np.copyto(frame, self.frame_buffer.buffer)
+
+            # the region images that go with this frame, the regions move on to the next one
+            # before the transmit thread records it (a new image every frame, no copy needed)
+            region_images = self.recorder.region_images() if self.recorder is not None else None
+
+            captured_at = min(capture[0] for capture in captures.values())
+            replaced = self.output_slot.put((captured_at, frame, region_images))
+            if replaced is not None:
+                self.free_snapshots.put(replaced[1])
+            self.frames_processed += 1
+            stats.record("process", time.perf_counter() - t)
+
+    def transmit_loop(self):
+        if self.interpolator is not None:
+            self.interpolate_loop()
+            return
+
+        while self.running:
+            item = self.output_slot.get(timeout=0.5)
+            if item is None:
+                continue
+            captured_at, frame, region_images = item
+
+            t = time.perf_counter()
+            for universe in self.frame_buffer.universes:
+                offset = self.frame_buffer.offset(universe)
+                self.sender[universe].dmx_data = frame[offset:offset+DMX_CHANNELS]
+            # the outputs copied the data, the snapshot can be reused
+            self.free_snapshots.put(frame)
+            # the outputs are bound to the live frame buffer, send the snapshot instead
+            self.sender.flush(pull=False)
+            if self.recorder is not None:
+                self.recorder.record_frame(images=region_images)
+            self.frames_sent += 1
+            now = time.perf_counter()
+            stats.record("send", now - t)
+            stats.record("latency", now - captured_at)
+
+    # Sends at the full fps, picking up new frames from the process thread whenever there is one.
+    # The sender is bound to the interpolator's output, so flush() sends the interpolated frame
+    def interpolate_loop(self):
+        clock = FrameClock(self.fps, report_interval=0)
+        captured_at = None
+        region_images = None
+        while self.running:
+            clock.wait()
+            item = self.output_slot.get(timeout=0)
+            now = time.perf_counter()
+            if item is not None:
+                captured_at, frame, region_images = item
+                self.interpolator.update(frame, now)
+                self.free_snapshots.put(frame)
+            if captured_at is None:
+                continue
+
+            self.interpolator.step(now)
+            self.sender.flush()
+            if self.recorder is not None:
+                self.recorder.record_frame(images=region_images)
+            self.frames_sent += 1
+            done = time.perf_counter()
+            stats.record("send", done - now)
+            if item is not None:
+                stats.record("latency", done - captured_at)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processed": self.frames_processed,
+            "sent": self.frames_sent,
+            "dropped": {slot.name: slot.dropped for slot in list(self.capture_slots.values()) + [self.output_slot]},
+        }
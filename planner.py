@@ -0,0 +1,44 @@
+import logging
+from typing import Dict, List, Set
+
+from mapping import PixelStrip
+from region import ScreenRegion
+
+# Capture planning.  By default every region grabs half of its monitor, which on a 4480x2130
+# screen is millions of pixels per region per frame, and nearly all of it gets thrown away by
+# resizing down to a 29x4 grid.  Using the compiled LED layout of each strip we know which rows
+# of each region's grid actually have LEDs, so each region only grabs a band 'density' lines
+# tall through the middle of those rows (see ScreenRegion.plan_bands).
+#
+# Fewer lines = less capture and conversion work, but the LEDs see less of the screen.  The
+# grid is resized per row either way, so the colors stay in the right rows
+#
+# density 0 goes back to capturing every region's whole box
+
+
+def plan_capture(pixel_strips: List[PixelStrip], density: int):
+    if density <= 0:
+        for region in {region for pixel_strip in pixel_strips for region in pixel_strip.regions}:
+            region.clear_bands()
+        return
+
+    grid_rows: Dict[ScreenRegion, Set[int]] = {}
+    used_rows: Dict[ScreenRegion, Set[int]] = {}
+    for pixel_strip in pixel_strips:
+        for region in pixel_strip.regions:
+            plan = pixel_strip.sample_plans[region.name]
+            grid_rows.setdefault(region, set()).add(pixel_strip.rows)
+            used_rows.setdefault(region, set()).update(plan.ys.tolist())
+
+    capture_cache = None
+    for region, rows in grid_rows.items():
+        capture_cache = region.capture
+        if len(rows) > 1:
+            # the bands are laid out per grid row, so every strip has to agree on the grid
+            logging.warning(f"not planning capture for region {region.name} on monitor {region.monitor_no}: "
+                            f"strips use different row counts {sorted(rows)}")
+            continue
+        region.plan_bands(rows.pop(), sorted(used_rows[region]), density)
+
+    if capture_cache is not None:
+        logging.debug(f"capture plan: {capture_cache.capture_boxes}, {capture_cache.pixels_per_frame()} pixels per frame")
@@ -0,0 +1,124 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+import PIL
+from PIL import Image
+
+# Box-filtered image pyramid of a captured box, built straight from the raw BGRA screenshot.
+#
+# Level 1 is the capture averaged down 2x2 (there's no full resolution RGB copy, the BGRX ->
+# RGB conversion is skipped entirely), every level after that halves the one before.  Levels
+# past 1 are only built when an LED asks for them.
+#
+# LEDs are described by their footprint on the screen (in screen coordinates), and each one is
+# sampled from the coarsest level where its footprint is still at least a pixel in both
+# directions: the average over the footprint is then just a handful of pixels, looked up in a
+# summed-area table of that level.  Every fixture sampling the same monitor shares the same
+# pyramid, so adding a fixture costs a few lookups instead of another full resize.
+#
+# Colors come out as RGB, the pyramid itself stays BGRA.
+
+MAX_LEVELS = 12
+
+
+# Summed-area table with a row/column of zeros on the top/left, so the sum of any box
+# is 4 lookups.  uint32 is enough for anything up to ~16M pixels
+def summed_area_table(arr: np.ndarray) -> np.ndarray:
+    h, w, c = arr.shape
+    sat = np.zeros((h+1, w+1, c), dtype=np.uint32)
+    np.cumsum(arr, axis=0, dtype=np.uint32, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+# Average factor x factor blocks (less when the image is smaller than that, a partial block at
+# the edge averages what's there).  PIL's reduce does the box filter in C, on the BGRX bytes as
+# they are: it doesn't care what the channels are, and RGBX has no alpha to premultiply
+def reduce(arr: np.ndarray, factor: int = 2) -> np.ndarray:
+    h, w = arr.shape[:2]
+    arr = np.ascontiguousarray(arr)
+    img = PIL.Image.frombuffer("RGBX", (w, h), arr, "raw", "RGBX", 0, 1)
+    return np.asarray(img.reduce((min(factor, w), min(factor, h))))
+
+
+class Pyramid:
+    # bgra: (h, w, 4) view of the captured box (possibly decimated, see CaptureCache.downscale)
+    # bb: the box on the screen it covers
+    def __init__(self, bgra: np.ndarray, bb: Tuple[int, int, int, int]):
+        self.bb = bb
+        # the screenshot buffer may get reused by the source, level 1 is our own copy
+        self.levels: Dict[int, np.ndarray] = {0: reduce(bgra)}
+        self.sats: Dict[int, np.ndarray] = {}
+
+    def __str__(self):
+        return f"Pyramid[{self.bb},levels={[self.levels[n].shape[:2] for n in sorted(self.levels)]}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    # Level n counted from 0 = level 1 (the 2x2 average).  Built straight from level 1 in one
+    # pass, averaging 2^n x 2^n blocks is the same as halving n times
+    def level(self, n: int) -> np.ndarray:
+        level = self.levels.get(n)
+        if level is None:
+            level = self.levels[n] = reduce(self.levels[0], 2 ** n)
+        return level
+
+    def sat(self, n: int) -> np.ndarray:
+        sat = self.sats.get(n)
+        if sat is None:
+            sat = self.sats[n] = summed_area_table(self.level(n)[:, :, :3])
+        return sat
+
+    # Average RGB color of every box (k, 4) of screen coordinates, clipped to this pyramid
+    def sample(self, boxes: np.ndarray) -> np.ndarray:
+        left, top, right, bottom = self.bb
+        origin = np.array([left, top, left, top])
+        local = np.clip(boxes, origin, [right, bottom, right, bottom]) - origin
+        extent = np.array([right - left, bottom - top, right - left, bottom - top], dtype=np.float64)
+
+        # footprint size in level 0 pixels, pick the coarsest level where it's still >= 1px
+        base = self.levels[0]
+        size = (local[:, 2:] - local[:, :2]) * [base.shape[1] / extent[0], base.shape[0] / extent[1]]
+        footprint = np.maximum(size.min(axis=1), 1.0)
+        levels = np.minimum(np.floor(np.log2(footprint)).astype(np.intp), MAX_LEVELS)
+
+        colors = np.zeros((len(boxes), 3), dtype=np.uint8)
+        for n in np.unique(levels):
+            n = int(n)
+            arr = self.level(n)
+            h, w = arr.shape[:2]
+            idx = np.nonzero(levels == n)[0]
+
+            # box in level pixels, rounded outwards and at least a pixel
+            scaled = local[idx] * ([w, h, w, h] / extent)
+            b0 = np.clip(np.floor(scaled[:, :2]).astype(np.intp), 0, [w - 1, h - 1])
+            b1 = np.clip(np.maximum(np.ceil(scaled[:, 2:]).astype(np.intp), b0 + 1), 1, [w, h])
+            bx0, by0 = b0[:, 0], b0[:, 1]
+            bx1, by1 = b1[:, 0], b1[:, 1]
+
+            sat = self.sat(n)
+            # uint32 wraps around, but the 4 corner sum still comes out right
+            total = sat[by1, bx1] - sat[by0, bx1] - sat[by1, bx0] + sat[by0, bx0]
+            area = ((bx1 - bx0) * (by1 - by0))[:, None]
+            bgr = (total + area // 2) // area
+            colors[idx] = bgr[:, ::-1]
+        return colors
+
+
+# Sample LED boxes (screen coordinates) out of the pyramids of every box captured on a monitor.
+# Each LED is sampled from the first captured box its footprint overlaps (with capture planning
+# that's the band through the middle of its row).  LEDs that don't overlap anything stay black
+def sample_pyramids(pyramids: List[Tuple[Pyramid, Tuple]], boxes: np.ndarray) -> np.ndarray:
+    colors = np.zeros((len(boxes), 3), dtype=np.uint8)
+    todo = np.ones(len(boxes), dtype=bool)
+    for pyramid, (left, top, right, bottom) in pyramids:
+        hit = todo & (boxes[:, 0] < right) & (boxes[:, 2] > left) & (boxes[:, 1] < bottom) & (boxes[:, 3] > top)
+        if not hit.any():
+            continue
+        idx = np.nonzero(hit)[0]
+        colors[idx] = pyramid.sample(boxes[idx])
+        todo[idx] = False
+        if not todo.any():
+            break
+    return colors
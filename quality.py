@@ -0,0 +1,159 @@
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Any
+
+import numpy as np
+import PIL
+
+import planner
+from capture import CaptureCache
+from mapping import PixelStrip
+
+# Closed loop quality control.  Measures what the draw loop costs (frame time and CPU) and
+# turns the capture quality down when it's over budget, and back up again when there's room.
+# When a game is using the machine the bias lighting backs off instead of stealing frame time,
+# on an idle desktop it runs at full quality.
+#
+# Each level is a set of knobs, from the best quality (level 0) to the cheapest:
+# - density: screen lines captured per row of LEDs (see planner.py, 0 = the whole region)
+# - downscale: keep every n-th pixel/line of the capture (CaptureCache.downscale)
+# - screen_percent: how much of the screen the regions look at (ScreenRegion.get_bounding_box)
+# - capture_interval: regions only capture every n-th frame and reuse the last image in between
+# - resample: resize filter, NEAREST < BOX < BILINEAR in cost
+#
+# Going down a level happens as soon as a window of frames is over budget.  Going back up needs
+# a few windows in a row with plenty of headroom, so it doesn't flip back and forth
+
+
+class QualityLevel(NamedTuple):
+    density: int
+    downscale: int
+    screen_percent: int
+    capture_interval: int
+    resample: int
+
+    def describe(self) -> str:
+        resample = {PIL.Image.NEAREST: "nearest", PIL.Image.BOX: "box", PIL.Image.BILINEAR: "bilinear"}.get(self.resample, self.resample)
+        return (f"density={self.density},downscale={self.downscale},screen_percent={self.screen_percent},"
+                f"capture_interval={self.capture_interval},resample={resample}")
+
+
+def default_levels(density: int = 16) -> List[QualityLevel]:
+    low = density or 16
+    return [
+        QualityLevel(density, 1, 50, 1, PIL.Image.BILINEAR),
+        QualityLevel(max(low // 2, 1), 2, 50, 1, PIL.Image.BILINEAR),
+        QualityLevel(max(low // 4, 1), 2, 40, 1, PIL.Image.BOX),
+        QualityLevel(max(low // 4, 1), 4, 40, 2, PIL.Image.BOX),
+        QualityLevel(max(low // 8, 1), 4, 30, 2, PIL.Image.NEAREST),
+        QualityLevel(1, 8, 30, 3, PIL.Image.NEAREST),
+        QualityLevel(1, 8, 25, 4, PIL.Image.NEAREST),
+    ]
+
+
+# budget_ms: 90th percentile of the frame time we're allowed
+# cpu_budget: fraction of one core the whole process is allowed (all threads)
+# window: frames between decisions
+# headroom: go up a level when cost is below headroom x budget...
+# upgrade_after: ...for this many windows in a row
+class QualityController:
+    def __init__(self, pixel_strips: List[PixelStrip], capture_cache: CaptureCache,
+                 budget_ms: Optional[float] = None, cpu_budget: Optional[float] = None,
+                 levels: Optional[List[QualityLevel]] = None, window: int = 30,
+                 headroom: float = 0.5, upgrade_after: int = 3,
+                 on_change: Callable[[str], None] = print,
+                 clock: Callable[[], float] = time.perf_counter, cpu_clock: Callable[[], float] = time.process_time):
+        self.pixel_strips = pixel_strips
+        self.capture_cache = capture_cache
+        self.budget = budget_ms / 1000 if budget_ms else None
+        self.cpu_budget = cpu_budget
+        self.levels = levels or default_levels()
+        self.window = window
+        self.headroom = headroom
+        self.upgrade_after = upgrade_after
+        self.on_change = on_change
+        self.clock = clock
+        self.cpu_clock = cpu_clock
+
+        self.regions = list({region: None for pixel_strip in pixel_strips for region in pixel_strip.regions})
+        self.frame_times: List[float] = []
+        self.window_start = clock()
+        self.cpu_start = cpu_clock()
+        self.good_windows = 0
+        self.changes = 0
+
+        # last window's numbers
+        self.frame_cost = 0.0
+        self.cpu = 0.0
+
+        self.level = 0
+        self.apply(self.level)
+
+    def __str__(self):
+        return f"QualityController[level={self.level}/{len(self.levels) - 1},{self.levels[self.level].describe()}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def apply(self, level: int):
+        self.level = level
+        settings = self.levels[level]
+        self.capture_cache.downscale = settings.downscale
+        for region in self.regions:
+            region.screen_percent = settings.screen_percent
+            region.capture_interval = settings.capture_interval
+            region.resample = settings.resample
+            region.last_resized = {}
+        # replans the capture boxes too, so they pick up the new screen_percent
+        planner.plan_capture(self.pixel_strips, settings.density)
+
+    # Call after every frame with how long it took.  Returns True when the level changed
+    def frame_done(self, seconds: float) -> bool:
+        self.frame_times.append(seconds)
+        if len(self.frame_times) < self.window:
+            return False
+
+        now = self.clock()
+        cpu_now = self.cpu_clock()
+        elapsed = now - self.window_start
+        self.cpu = (cpu_now - self.cpu_start) / elapsed if elapsed > 0 else 0.0
+        self.frame_cost = float(np.percentile(self.frame_times, 90))
+        self.frame_times = []
+        self.window_start = now
+        self.cpu_start = cpu_now
+
+        over = ((self.budget is not None and self.frame_cost > self.budget) or
+                (self.cpu_budget is not None and self.cpu > self.cpu_budget))
+        under = ((self.budget is None or self.frame_cost < self.budget * self.headroom) and
+                 (self.cpu_budget is None or self.cpu < self.cpu_budget * self.headroom))
+
+        new_level = self.level
+        if over:
+            self.good_windows = 0
+            new_level = min(self.level + 1, len(self.levels) - 1)
+        elif under:
+            self.good_windows += 1
+            if self.good_windows >= self.upgrade_after:
+                self.good_windows = 0
+                new_level = max(self.level - 1, 0)
+        else:
+            self.good_windows = 0
+
+        if new_level == self.level:
+            return False
+
+        direction = "down" if new_level > self.level else "up"
+        self.apply(new_level)
+        self.changes += 1
+        if self.on_change is not None:
+            self.on_change(f"quality {direction} to level {new_level} (frame p90 {self.frame_cost*1000:.2f}ms, "
+                           f"cpu {self.cpu*100:.0f}%): {self.levels[new_level].describe()}")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "level": self.level,
+            "settings": self.levels[self.level].describe(),
+            "frame_p90_ms": self.frame_cost * 1000,
+            "cpu": self.cpu,
+            "changes": self.changes,
+        }
@@ -0,0 +1,199 @@
+import json
+import mmap
+import struct
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import PIL
+from PIL import Image
+
+from e131 import DMX_CHANNELS
+
+# Record the frames that go out to the controllers, and play them back later without capturing
+# the screen at all (benchmarking the output path on its own, reproducing choppy output, or
+# running a recorded light show with zero capture CPU).
+#
+# File layout, little endian:
+#
+#   header      magic "ESPBLOOM", version, metadata length, record size, data offset
+#   metadata    json: universes + destinations, recorded region images, fps
+#   padding     to 64 bytes
+#   records     one per frame, all the same size:
+#                 timestamp (float64, seconds since the recording started), frame number (uint64)
+#                 512 channels per universe, in the order of the metadata's universe list
+#                 the region images (RGB, resized to the LED grid), if they were recorded
+#
+# Records are only ever appended, so a recording that got cut off (crash, ctrl-c) just loses
+# its last partial record.  Since every record is the same size, playback memory-maps the file
+# and indexes straight into it, the channel data is copied from the page cache into the packets
+
+MAGIC = b"ESPBLOOM"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIIIQ")
+RECORD_HEADER = struct.Struct("<dQ")
+ALIGNMENT = 64
+
+
+class Recorder:
+    # regions: (region, size) of every region image to record along with the channel data
+    def __init__(self, path: str, sender, regions: Optional[List[Tuple[object, Tuple[int, int]]]] = None,
+                 fps: Optional[float] = None, clock: Callable[[], float] = time.perf_counter):
+        self.path = path
+        self.sender = sender
+        self.universes = sorted(sender.outputs)
+        self.regions = regions or []
+        self.clock = clock
+
+        metadata = {
+            "universes": [{"universe": universe, "destination": sender.outputs[universe].destination}
+                          for universe in self.universes],
+            "regions": [{"label": region.label(), "size": list(size)} for region, size in self.regions],
+            "fps": fps,
+            "created": time.time(),
+        }
+        metadata_bytes = json.dumps(metadata).encode("utf-8")
+
+        image_bytes = sum(width * height * 3 for _, (width, height) in self.regions)
+        self.record_size = RECORD_HEADER.size + len(self.universes) * DMX_CHANNELS + image_bytes
+        data_offset = -(-(HEADER.size + len(metadata_bytes)) // ALIGNMENT) * ALIGNMENT
+
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(metadata_bytes), self.record_size, data_offset))
+        self.file.write(metadata_bytes)
+        self.file.write(bytes(data_offset - HEADER.size - len(metadata_bytes)))
+
+        # one record, reused for every frame
+        self.record = bytearray(self.record_size)
+        self.start: Optional[float] = None
+        self.frames = 0
+
+    def __str__(self):
+        return f"Recorder[{self.path},universes={self.universes},regions={len(self.regions)},frames={self.frames}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    # The region images to record with the frame that's being rendered right now.  The pipeline
+    # takes them on the process thread along with the frame and hands them to record_frame on the
+    # transmit thread, by then the regions hold the next frame's images
+    def region_images(self) -> List[Optional[PIL.Image.Image]]:
+        return [getattr(region, "last_image", None) for region, _ in self.regions]
+
+    # Append the frame that was just flushed.  images: region_images() of that frame (default:
+    # the regions' images right now)
+    def record_frame(self, now: Optional[float] = None, images: Optional[List[Optional[PIL.Image.Image]]] = None):
+        now = self.clock() if now is None else now
+        if self.start is None:
+            self.start = now
+
+        RECORD_HEADER.pack_into(self.record, 0, now - self.start, self.frames)
+        offset = RECORD_HEADER.size
+        for universe in self.universes:
+            self.record[offset:offset + DMX_CHANNELS] = self.sender.outputs[universe].data
+            offset += DMX_CHANNELS
+
+        if images is None:
+            images = self.region_images()
+        for img, (_, (width, height)) in zip(images, self.regions):
+            length = width * height * 3
+            if img is not None and img.size == (width, height):
+                self.record[offset:offset + length] = img.tobytes()
+            else:
+                self.record[offset:offset + length] = bytes(length)
+            offset += length
+
+        self.file.write(self.record)
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+
+
+class Recording:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        magic, version, metadata_length, self.record_size, self.data_offset = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an esp-bloom recording")
+        if version != VERSION:
+            raise ValueError(f"{path}: unsupported recording version {version}")
+
+        self.metadata = json.loads(bytes(self.mmap[HEADER.size:HEADER.size + metadata_length]))
+        self.universes = [entry["universe"] for entry in self.metadata["universes"]]
+        self.destinations: Dict[int, str] = {entry["universe"]: entry["destination"] for entry in self.metadata["universes"]}
+
+        # where each universe / region image starts within a record
+        self.universe_offsets: Dict[int, int] = {}
+        offset = RECORD_HEADER.size
+        for universe in self.universes:
+            self.universe_offsets[universe] = offset
+            offset += DMX_CHANNELS
+        self.region_offsets: Dict[str, Tuple[int, Tuple[int, int]]] = {}
+        for entry in self.metadata["regions"]:
+            size = tuple(entry["size"])
+            self.region_offsets[entry["label"]] = (offset, size)
+            offset += size[0] * size[1] * 3
+
+        # a partial record at the end (recording was cut off) is ignored
+        self.frame_count = (len(self.mmap) - self.data_offset) // self.record_size
+
+    def __str__(self):
+        return f"Recording[{self.path},universes={self.universes},frames={self.frame_count},duration={self.duration():.1f}s]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __len__(self):
+        return self.frame_count
+
+    def record_offset(self, frame: int) -> int:
+        return self.data_offset + frame * self.record_size
+
+    def timestamp(self, frame: int) -> float:
+        return RECORD_HEADER.unpack_from(self.mmap, self.record_offset(frame))[0]
+
+    def duration(self) -> float:
+        return self.timestamp(self.frame_count - 1) if self.frame_count else 0.0
+
+    # The 512 channels of a universe, straight out of the mapped file
+    def universe_data(self, frame: int, universe: int) -> memoryview:
+        start = self.record_offset(frame) + self.universe_offsets[universe]
+        return self.view[start:start + DMX_CHANNELS]
+
+    def region_image(self, frame: int, label: str) -> PIL.Image.Image:
+        offset, size = self.region_offsets[label]
+        start = self.record_offset(frame) + offset
+        return PIL.Image.frombytes("RGB", size, bytes(self.view[start:start + size[0] * size[1] * 3]))
+
+    def close(self):
+        self.view.release()
+        self.mmap.close()
+        self.file.close()
+
+
+# Send a recording to the controllers with the original timing.  Frames are scheduled against
+# absolute times, so a slow frame doesn't push back the ones after it.  The sender needs an
+# (unbound) output for every universe in the recording
+def replay(recording: Recording, sender, loop: bool = False, speed: float = 1.0,
+           clock: Callable[[], float] = time.perf_counter, sleep: Callable[[float], None] = time.sleep) -> int:
+    frames_sent = 0
+    while True:
+        start = clock()
+        for frame in range(recording.frame_count):
+            due = start + recording.timestamp(frame) / speed
+            now = clock()
+            if now < due:
+                sleep(due - now)
+
+            for universe in recording.universes:
+                sender[universe].dmx_data = recording.universe_data(frame, universe)
+            sender.flush(pull=False)
+            frames_sent += 1
+
+        if not loop or recording.frame_count == 0:
+            return frames_sent
@@ -1,25 +1,127 @@
-from typing import Tuple
-
-import mss
-from mss import models
-from mss.base import MSSBase
-from mss.screenshot import ScreenShot
+import time
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import PIL
 from PIL import Image
 
+import diagnostics
+import stats
+from capture import CaptureCache
+from pyramid import sample_pyramids
+
 class ScreenRegion:
-    def __init__(self, name: str, monitor_no: int, mss: MSSBase):
+    def __init__(self, name: str, monitor_no: int, capture: CaptureCache):
         self.name = name
         self.monitor_no = monitor_no
-        self.mss = mss
-        self.monitor = mss.monitors[monitor_no]
+        self.capture = capture
+        self.monitor = capture.monitors[monitor_no]
+
+        # Set by plan_bands: (grid rows, rows that have LEDs, lines per row).  When set we only
+        # capture a thin band through the middle of every LED row instead of the whole box
+        self.band_plan: Optional[Tuple[int, Tuple[int, ...], int]] = None
+
+        # How much of the screen (top/bottom half by default) the region looks at
+        self.screen_percent = 50
+
+        # Filter used to resize the screen down to the LED grid
+        self.resample = PIL.Image.BILINEAR
+
+        # Only capture every n-th frame, in between the last resized image is reused (when every
+        # region on a monitor skips a frame the monitor isn't grabbed at all)
+        self.capture_interval = 1
+        self.last_resized: Dict[Tuple[int, int], PIL.Image.Image] = {}
+
+        # Drops the region to an idle capture rate while the screen isn't changing (see idle.py)
+        self.change_detector = None
+
+        # The newest resized image (e.g. for recordings)
+        self.last_image: Optional[PIL.Image.Image] = None
+
+        # Let the capture cache know which part of the monitor we need
+        self.update_capture()
+
+    # Name for logs and stats
+    def label(self) -> str:
+        return f"{self.monitor_no}-{self.name}"
+
+    # The (monitor, bounding box) pairs this region reads from
+    def source_boxes(self) -> List[Tuple[int, Tuple]]:
+        return [(self.monitor_no, self.get_bounding_box(self.name, self.monitor))]
+
+    # Only capture what the LEDs actually look at.  The region gets resized down to a grid of
+    # 'rows' rows, and only 'used_rows' of them have LEDs in them (e.g. the bottom 2 of 4 for
+    # the monitor strips).  Instead of the whole box we grab a band 'density' lines tall
+    # through the middle of each of those rows
+    def plan_bands(self, rows: int, used_rows: List[int], density: int):
+        self.band_plan = (rows, tuple(sorted(used_rows)), density)
+        self.update_capture()
+
+    # Back to capturing the whole box
+    def clear_bands(self):
+        self.band_plan = None
+        self.update_capture()
+
+    # (Re)register what we need with the capture cache, after the bands or the screen_percent changed
+    def update_capture(self):
+        self.capture.unregister(self)
+        for monitor_no, bb in self.source_boxes():
+            for box in self.capture_boxes(bb, self.band_plan):
+                self.capture.register(monitor_no, box, owner=self)
+
+    # The boxes that have to be captured to resize 'bb' with a band plan
+    @staticmethod
+    def capture_boxes(bb: Tuple, band_plan: Optional[Tuple]) -> List[Tuple]:
+        if band_plan is None:
+            return [bb]
+        rows, used_rows, density = band_plan
+        return [ScreenRegion.band_box(bb, rows, row, density) for row in used_rows]
+
+    @staticmethod
+    def band_box(bb: Tuple, rows: int, row: int, density: int) -> Tuple:
+        left, top, right, bottom = bb
+        row_top = top + (bottom - top) * row // rows
+        row_bottom = top + (bottom - top) * (row + 1) // rows
+        height = max(min(density, row_bottom - row_top), 1)
+        band_top = (row_top + row_bottom - height) // 2
+        return left, band_top, right, band_top + height
+
+    # Resize a box of the screen to 'size'.  Capture workers (workers.py) may have done it already
+    def resize_box(self, monitor_no: int, bb: Tuple, size: Tuple[int, int]) -> PIL.Image:
+        resized = self.capture.resized.get((monitor_no, bb, size, self.band_plan, self.resample))
+        if resized is not None:
+            return resized
+        return self.resize_from_capture(self.capture, monitor_no, bb, size, self.band_plan, self.resample)
+
+    # Resize straight out of the captured box, or row by row out of the bands (rows without
+    # LEDs stay black)
+    @staticmethod
+    def resize_from_capture(capture: CaptureCache, monitor_no: int, bb: Tuple, size: Tuple[int, int],
+                            band_plan: Optional[Tuple], resample: int) -> PIL.Image:
+        if band_plan is None or size[1] % band_plan[0] != 0:
+            img, box = capture.get_region(monitor_no, bb)
+            return img.resize(size, resample=resample, box=box)
+
+        rows, used_rows, density = band_plan
+        row_height = size[1] // rows
+        resized = Image.new("RGB", size)
+        for row in used_rows:
+            img, box = capture.get_region(monitor_no, ScreenRegion.band_box(bb, rows, row, density))
+            resized.paste(img.resize((size[0], row_height), resample=resample, box=box), (0, row * row_height))
+        return resized
+
+    # The (monitor, bounding box, size) of every resize_box call capture_and_resize makes for an
+    # LED grid of img_x x img_y.  None when the last image gets reused this frame
+    def resize_jobs(self, img_x: int, img_y: int) -> Optional[List[Tuple[int, Tuple, Tuple[int, int]]]]:
+        if self.reuse_resized((img_x, img_y)) is not None:
+            return None
+        return [(self.monitor_no, self.get_bounding_box(self.name, self.monitor), (img_x, img_y))]
 
     # Get a bounding box for a screen area
     # should be refactored, moved this in here from outside the class
     def get_bounding_box(self, region_name: str, monitor):
-        # Capture 50% of the screen
-        screen_percent = 50
+        # Capture 50% of the screen (unless the quality controller turned it down)
+        screen_percent = self.screen_percent
 
         # print(f"getting bb for monitor {monitor}")
         # pprint(monitor)
@@ -47,25 +149,78 @@ class ScreenRegion:
         # pprint(bb)
         return bb
 
-    # Take a screenshot of the screen region
+    # Get the screen region out of this frame's shared screenshot.  Returns the monitor image
+    # and our box within it, the pixels are not copied
     def screenshot(self, bb: Tuple):
-        return self.mss.grab(bb)  # Take the screenshot
+        return self.capture.get_region(self.monitor_no, bb)
+
+    # Frames between captures, the bigger of the configured interval and the idle interval
+    def current_interval(self) -> int:
+        if self.change_detector is None:
+            return self.capture_interval
+        return max(self.capture_interval, self.change_detector.interval())
+
+    # The image resized (or LEDs sampled, for pyramid sampling) on an earlier frame, if this
+    # isn't one of the frames we capture on.  key is the image size or the SamplePlan
+    def reuse_resized(self, key) -> Optional[PIL.Image.Image]:
+        interval = self.current_interval()
+        if interval <= 1 or self.capture.frame_no % interval == 0:
+            return None
+        return self.last_resized.get(key)
+
+    def keep_resized(self, resized, key=None):
+        if key is None:
+            self.last_image = resized
+            key = resized.size
+        if self.change_detector is not None:
+            self.change_detector.update(resized)
+        if self.capture_interval > 1 or self.change_detector is not None:
+            self.last_resized[key] = resized
+        return resized
+
+    # Footprint of every LED of a SamplePlan on the screen, as (monitor_no, LED indices,
+    # (k, 4) boxes in screen coordinates) per monitor.  Every row of LEDs is stretched over
+    # the whole width of the region
+    def led_boxes(self, plan) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+        left, top, right, bottom = self.get_bounding_box(self.name, self.monitor)
+        boxes = np.stack([
+            left + plan.nu0 * (right - left), top + plan.v0 * (bottom - top),
+            left + plan.nu1 * (right - left), top + plan.v1 * (bottom - top),
+        ], axis=1)
+        return [(self.monitor_no, np.arange(len(plan)), boxes)]
+
+    # RGB color of every LED of a SamplePlan, averaged over its footprint out of the monitor
+    # pyramids (pyramid sampling)
+    def sample_leds(self, plan) -> np.ndarray:
+        reused = self.reuse_resized(plan)
+        if reused is not None:
+            return reused
+
+        colors = np.zeros((len(plan), 3), dtype=np.uint8)
+        for monitor_no, idx, boxes in self.led_boxes(plan):
+            colors[idx] = sample_pyramids(self.capture.get(monitor_no), boxes)
+        return self.keep_resized(colors, plan)
 
     # Capture a screenshot and resize it to the low-res of the LEDs
     def capture_and_resize(self, img_x: int, img_y: int, save_image: bool) -> PIL.Image:
+        reused = self.reuse_resized((img_x, img_y))
+        if reused is not None:
+            return reused
+
         bb = self.get_bounding_box(self.name, self.monitor)
-        screenshot = self.screenshot(bb)
-        img = PIL.Image.frombytes("RGB", screenshot.size, screenshot.bgra, "raw", "BGRX")  # Convert to PIL.Image
 
-        if save_image:
-            img.save(f"saved-images/monitor-{self.monitor_no}-{self.name}.png")
+        if save_image and self.band_plan is None and diagnostics.default_tap.active:
+            img, box = self.screenshot(bb)
+            diagnostics.tap(f"monitor-{self.monitor_no}-{self.name}", img, box)
 
         # Resize to the size of the pixel bounds
-        resized = img.resize((img_x, img_y), resample=PIL.Image.BILINEAR)
+        t = time.perf_counter()
+        resized = self.resize_box(self.monitor_no, bb, (img_x, img_y))
+        stats.record(f"resize.{self.label()}", time.perf_counter() - t)
         if save_image:
-            resized.save(f"saved-images/monitor-{self.monitor_no}-{self.name}-resized.png")
+            diagnostics.tap(f"monitor-{self.monitor_no}-{self.name}-resized", resized)
 
-        return resized
+        return self.keep_resized(resized)
 
 # Hacky class to define a 'combined region' which is both the bottom regions from 2 separate monitors
 # This was the final fixture I implemented and is my desk.  The LEDs span the entire length of my desk
@@ -78,38 +233,90 @@ class CombineRegion(ScreenRegion):
     #  {'height': 1050, 'left': 2560, 'top': 1080, 'width': 1680},
     #  {'height': 1080, 'left': 2560, 'top': 0, 'width': 1920}]
 
+    def label(self) -> str:
+        return f"combined-{self.name}"
+
+    # we read both monitor bottoms out of the shared capture
+    def source_boxes(self) -> List[Tuple[int, Tuple]]:
+        return [
+            (1, self.get_bounding_box("bottom", self.capture.monitors[1])),
+            (3, self.get_bounding_box("bottom", self.capture.monitors[3])),
+        ]
+
     # Grab both bounding boxes and take 2 separate screenshots.  We then resize them,
     # giving half the horizontal resolution to the left side monitor and the remainder
     # to the right side monitor.  When we stich them together, we have a single image in
     # the correct resolution for the single LED fixture that contains color data from
     # both monitors in (roughly) the correct proportions
     def capture_and_resize(self, img_x: int, img_y: int, save_image: bool) -> PIL.Image:
+        reused = self.reuse_resized((img_x, img_y))
+        if reused is not None:
+            return reused
+
         # capture monitor 1 bottom and monitor 3 bottom
         #
         # do it for 2 monitors here:  just hardcode the shtuff.  its hackathon :D
+        # the screenshots come out of the capture cache, so these are the same pixels
+        # regionBottom1/regionBottom3 already grabbed this frame
+
+        bb_mon_1 = self.get_bounding_box("bottom", self.capture.monitors[1])
+        bb_mon_2 = self.get_bounding_box("bottom", self.capture.monitors[3])
 
-        bb_mon_1 = self.get_bounding_box("bottom", self.mss.monitors[1])
-        ss_mon_1 = self.screenshot(bb_mon_1)
-        img_mon_1 = PIL.Image.frombytes("RGB", ss_mon_1.size, ss_mon_1.bgra, "raw", "BGRX")  # Convert to PIL.Image
-        img_mon_1_resized = img_mon_1.resize((img_x//2, img_y), resample=PIL.Image.BILINEAR)
+        # grab first so the grabs don't end up in the resize timing (unless the capture workers
+        # resized everything already)
+        for monitor_no, bb, size in self.resize_jobs(img_x, img_y):
+            if (monitor_no, bb, size, self.band_plan, self.resample) not in self.capture.resized:
+                self.capture.get(monitor_no)
+
+        t = time.perf_counter()
+        img_mon_1_resized = self.resize_box(1, bb_mon_1, (img_x//2, img_y))
         if save_image:
-            img_mon_1_resized.save(f"saved-images/monitor-bottom-combined-left-resized.png")
+            diagnostics.tap("monitor-bottom-combined-left-resized", img_mon_1_resized)
 
-        bb_mon_2 = self.get_bounding_box("bottom", self.mss.monitors[3])
-        ss_mon_2 = self.screenshot(bb_mon_2)
-        img_mon_2 = PIL.Image.frombytes("RGB", ss_mon_2.size, ss_mon_2.bgra, "raw", "BGRX")  # Convert to PIL.Image
-        img_mon_2_resized = img_mon_2.resize((img_x-(img_x//2), img_y), resample=PIL.Image.BILINEAR)
+        img_mon_2_resized = self.resize_box(3, bb_mon_2, (img_x-(img_x//2), img_y))
         if save_image:
-            img_mon_2_resized.save(f"saved-images/monitor-bottom-combined-right-resized.png")
+            diagnostics.tap("monitor-bottom-combined-right-resized", img_mon_2_resized)
 
         # stitch the images together
         img_concat = self.get_concat_h(img_mon_1_resized, img_mon_2_resized)
+        stats.record(f"resize.{self.label()}", time.perf_counter() - t)
 
         if save_image:
-            img_concat.save(f"saved-images/monitor-bottom-combined-resized.png")
+            diagnostics.tap("monitor-bottom-combined-resized", img_concat)
+
+        return self.keep_resized(img_concat)
+
+
+    # The desk spans both monitors in proportion to how wide their boxes are: an LED samples
+    # monitor 1 if the middle of its footprint is on monitor 1's part of the row, monitor 3
+    # otherwise (clipped to that monitor)
+    def led_boxes(self, plan) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+        bb_1 = self.get_bounding_box("bottom", self.capture.monitors[1])
+        bb_3 = self.get_bounding_box("bottom", self.capture.monitors[3])
+        width_1 = bb_1[2] - bb_1[0]
+        total = width_1 + bb_3[2] - bb_3[0]
+
+        x0 = plan.nu0 * total
+        x1 = plan.nu1 * total
+        on_1 = (x0 + x1) / 2 < width_1
 
-        return img_concat
+        res = []
+        for monitor_no, (left, top, right, bottom), mask, shift in ((1, bb_1, on_1, 0), (3, bb_3, ~on_1, width_1)):
+            idx = np.nonzero(mask)[0]
+            boxes = np.stack([
+                np.clip(left + x0[idx] - shift, left, right), top + plan.v0[idx] * (bottom - top),
+                np.clip(left + x1[idx] - shift, left, right), top + plan.v1[idx] * (bottom - top),
+            ], axis=1)
+            res.append((monitor_no, idx, boxes))
+        return res
 
+    def resize_jobs(self, img_x: int, img_y: int) -> Optional[List[Tuple[int, Tuple, Tuple[int, int]]]]:
+        if self.reuse_resized((img_x, img_y)) is not None:
+            return None
+        return [
+            (1, self.get_bounding_box("bottom", self.capture.monitors[1]), (img_x//2, img_y)),
+            (3, self.get_bounding_box("bottom", self.capture.monitors[3]), (img_x-(img_x//2), img_y)),
+        ]
 
     def get_concat_h(self, im1, im2):
         dst = Image.new('RGB', (im1.width + im2.width, im1.height))
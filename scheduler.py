@@ -0,0 +1,278 @@
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import stats
+
+
+# Frame clock that runs the draw loop against absolute deadlines instead of sleeping a fixed
+# amount after each frame.  The time spent capturing/processing comes out of the frame budget
+# instead of piling up on top of the sleep, and since deadlines are absolute (start + n*period)
+# small errors in time.sleep don't drift the frame rate.
+#
+# When a frame overruns:
+# - less than 1 period late: the next frame starts right away and we catch back up to the schedule
+# - 1+ periods late: the deadlines we blew through are dropped (counted in 'dropped') and we
+#   resync to the most recent one, instead of running a burst of frames back to back
+class FrameClock:
+    def __init__(self, fps: float, report_interval: float = 10.0,
+                 clock: Callable[[], float] = time.perf_counter, sleep: Callable[[float], None] = time.sleep,
+                 on_report: Callable[[str], None] = print):
+        self.fps = fps
+        self.period = 1 / fps
+        self.report_interval = report_interval
+        self.on_report = on_report
+        self.clock = clock
+        self.sleep = sleep
+
+        self.next_deadline: Optional[float] = None
+        self.total_frames = 0
+        self.total_dropped = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.report_start = self.clock()
+        self.frames = 0
+        self.dropped = 0
+
+        # lateness = how far after its deadline a frame actually started
+        self.lateness_sum = 0.0
+        self.lateness_sq_sum = 0.0
+        self.lateness_max = 0.0
+
+    # Wait until the next frame is due.  Returns the number of frames dropped to get there
+    def wait(self) -> int:
+        now = self.clock()
+        if self.next_deadline is None:
+            self.next_deadline = now
+            self.report_start = now
+        else:
+            self.next_deadline += self.period
+
+        dropped = 0
+        if now >= self.next_deadline + self.period:
+            dropped = math.floor((now - self.next_deadline) / self.period)
+            self.next_deadline += dropped * self.period
+
+        if now < self.next_deadline:
+            self.sleep(self.next_deadline - now)
+            now = self.clock()
+
+        lateness = max(now - self.next_deadline, 0.0)
+        self.lateness_sum += lateness
+        self.lateness_sq_sum += lateness * lateness
+        self.lateness_max = max(self.lateness_max, lateness)
+        self.frames += 1
+        self.dropped += dropped
+        self.total_frames += 1
+        self.total_dropped += dropped
+
+        if self.report_interval and now - self.report_start >= self.report_interval:
+            self.on_report(self.report())
+            self.reset_stats()
+
+        return dropped
+
+    def achieved_fps(self) -> float:
+        elapsed = self.clock() - self.report_start
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    # Standard deviation of frame start times around their deadlines
+    def jitter(self) -> float:
+        if self.frames == 0:
+            return 0.0
+        mean = self.lateness_sum / self.frames
+        return math.sqrt(max(self.lateness_sq_sum / self.frames - mean * mean, 0.0))
+
+    def report(self) -> str:
+        mean = self.lateness_sum / self.frames if self.frames else 0.0
+        return (f"fps: {self.achieved_fps():.1f}/{self.fps:g}, jitter: {self.jitter()*1000:.2f}ms, "
+                f"late: avg {mean*1000:.2f}ms max {self.lateness_max*1000:.2f}ms, "
+                f"dropped: {self.dropped} ({self.total_dropped} total)")
+
+
+# One fixture's target rate / priority, when its next update is due and how it's keeping up
+class FixtureSchedule:
+    def __init__(self, pixel_strip, fps: float, priority: int, universes: List[int]):
+        self.pixel_strip = pixel_strip
+        self.name = pixel_strip.strip_addr
+        self.fps = fps
+        self.period = 1 / fps
+        self.priority = priority
+        self.universes = universes
+
+        self.deadline: Optional[float] = None
+        self.total_updates = 0
+        self.total_dropped = 0
+        self.total_missed = 0
+        self.reset_stats()
+
+    def __str__(self):
+        return f"FixtureSchedule[{self.name},fps={self.fps:g},priority={self.priority}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def reset_stats(self):
+        self.updates = 0
+        self.dropped = 0
+        self.missed = 0
+        self.deferred = 0
+
+        # latency = from the deadline of an update until its universes were sent
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    # The update due at self.deadline went out at 'now', schedule the next one.  Same rules as
+    # the FrameClock: a deadline a whole period or more in the past is dropped
+    def sent(self, now: float) -> float:
+        latency = now - self.deadline
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.updates += 1
+        self.total_updates += 1
+        if latency > self.period:
+            self.missed += 1
+            self.total_missed += 1
+
+        self.deadline += self.period
+        if now >= self.deadline + self.period:
+            dropped = math.floor((now - self.deadline) / self.period)
+            self.deadline += dropped * self.period
+            self.dropped += dropped
+            self.total_dropped += dropped
+        return latency
+
+    def report(self, elapsed: float) -> str:
+        fps = self.updates / elapsed if elapsed > 0 else 0.0
+        mean = self.latency_sum / self.updates if self.updates else 0.0
+        return (f"{self.name}: {fps:.1f}/{self.fps:g} fps, priority {self.priority}, "
+                f"latency: avg {mean*1000:.2f}ms max {self.latency_max*1000:.2f}ms, "
+                f"deferred: {self.deferred}, missed: {self.missed}, dropped: {self.dropped}")
+
+
+# A schedule for every strip, at the strip's own fps (or 'fps' if it doesn't have one)
+def create_fixture_schedules(pixel_strips, frame_buffer, fps: float) -> List[FixtureSchedule]:
+    return [
+        FixtureSchedule(pixel_strip, pixel_strip.fps or fps, pixel_strip.priority, frame_buffer.strip_universes(pixel_strip))
+        for pixel_strip in pixel_strips
+    ]
+
+
+# Updates every fixture at its own rate instead of all of them in lockstep.  Each fixture has a
+# deadline (absolute, start + n*period like the FrameClock), and the scheduler wakes up at the
+# earliest one.  All the fixtures due by then are updated in priority order (highest first,
+# then earliest deadline), and each one's universes are sent as soon as it's rendered, so a
+# high priority fixture never waits on a lower priority one's capture/resize or its packets.
+#
+# When a tick runs past 'budget' x the shortest period, the lower priority fixtures still due
+# are deferred to the next tick instead of making everything late.  A fixture is only ever
+# deferred until it's a whole period late, so nothing starves.
+#
+# The scheduler doesn't capture or send anything itself:
+# - new_frame(): start a new frame (throw away the last screenshots), once per tick with work
+# - render(pixel_strip): capture/sample the strip into its color data
+# - send(universes): send those universes
+class OutputScheduler:
+    def __init__(self, fixtures: List[FixtureSchedule], new_frame: Callable[[], None],
+                 render: Callable[[object], None], send: Callable[[List[int]], None], budget: float = 0.8,
+                 report_interval: float = 10.0, on_report: Callable[[str], None] = print,
+                 clock: Callable[[], float] = time.perf_counter, sleep: Callable[[float], None] = time.sleep):
+        # highest priority first, so ties in the tick's sort keep that order
+        self.fixtures = sorted(fixtures, key=lambda fixture: -fixture.priority)
+        self.new_frame = new_frame
+        self.render = render
+        self.send = send
+        self.budget = budget
+        self.report_interval = report_interval
+        self.on_report = on_report
+        self.clock = clock
+        self.sleep = sleep
+
+        self.tick_period = min(fixture.period for fixture in self.fixtures)
+        self.ticks = 0
+        self.report_start = clock()
+        # when the first tick was due, for the rates since then
+        self.started: Optional[float] = None
+
+    def __str__(self):
+        return f"OutputScheduler[{','.join(f'{f.name}@{f.fps:g}/p{f.priority}' for f in self.fixtures)}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    # Sleep until the next fixture is due
+    def wait(self):
+        now = self.clock()
+        if self.fixtures[0].deadline is None:
+            for fixture in self.fixtures:
+                fixture.deadline = now
+            self.report_start = now
+            self.started = now
+            return
+
+        next_deadline = min(fixture.deadline for fixture in self.fixtures)
+        if now < next_deadline:
+            self.sleep(next_deadline - now)
+
+    # Update every fixture that's due.  Returns the fixtures that were updated
+    def tick(self) -> List[FixtureSchedule]:
+        start = self.clock()
+        due = sorted((fixture for fixture in self.fixtures if fixture.deadline <= start),
+                     key=lambda fixture: (-fixture.priority, fixture.deadline))
+
+        updated = []
+        if due:
+            self.ticks += 1
+            self.new_frame()
+            top_priority = due[0].priority
+            out_of_time = start + self.budget * self.tick_period
+
+            for fixture in due:
+                now = self.clock()
+                if fixture.priority < top_priority and now > out_of_time and now - fixture.deadline < fixture.period:
+                    fixture.deferred += 1
+                    stats.count(f"deferred.{fixture.name}")
+                    continue
+
+                self.render(fixture.pixel_strip)
+                self.send(fixture.universes)
+                sent = self.clock()
+                stats.record(f"update.{fixture.name}", sent - now)
+                stats.record(f"latency.{fixture.name}", fixture.sent(sent))
+                updated.append(fixture)
+
+        now = self.clock()
+        if self.report_interval and now - self.report_start >= self.report_interval:
+            self.on_report(self.report())
+            for fixture in self.fixtures:
+                fixture.reset_stats()
+            self.report_start = now
+        return updated
+
+    def report(self) -> str:
+        elapsed = self.clock() - self.report_start
+        return "\n".join(fixture.report(elapsed) for fixture in self.fixtures)
+
+    def elapsed(self) -> float:
+        return self.clock() - self.started if self.started is not None else 0.0
+
+    # The scheduler's counterpart of the frame clock numbers: output passes (ticks) per second
+    def clock_stats(self) -> Dict[str, Any]:
+        elapsed = self.elapsed()
+        return {
+            "fps": self.ticks / elapsed if elapsed > 0 else 0.0, "frames": self.ticks,
+            "dropped": sum(fixture.total_dropped for fixture in self.fixtures),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = self.elapsed()
+        return {
+            fixture.name: {
+                "fps": fixture.fps, "achieved_fps": fixture.total_updates / elapsed if elapsed > 0 else 0.0,
+                "priority": fixture.priority, "updates": fixture.total_updates,
+                "missed": fixture.total_missed, "dropped": fixture.total_dropped,
+                "latency_max_ms": fixture.latency_max * 1000,
+            }
+            for fixture in self.fixtures
+        }
@@ -0,0 +1,316 @@
+import glob
+import mmap
+import os
+import struct
+import time
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+import PIL
+from PIL import Image
+
+# Frame sources: where the screen pixels come from.  CaptureCache only needs two things from a
+# source, the same as from an mss instance:
+# - monitors: list of {"left", "top", "width", "height"} dicts, [0] is the whole virtual screen
+# - grab(bb): returns a frame with .size (width, height) and .bgra (BGRA pixel rows).  Frames can
+#   also have a .stride (bytes per row) so a source can hand out a view into a bigger buffer
+#   without copying the box out first
+#
+# Sources:
+# - MssSource: screenshots of the desktop (what we've always done)
+# - SyntheticSource: generated test patterns, for running headless / benchmarks
+# - FileSource: a video file or a sequence of images
+# - SharedMemorySource: frames published into a memory-mapped ring buffer by another process
+#   (game capture, compositor plugin, ...).  See SharedMemoryPublisher
+# - XShmSource: X11 screenshots into persistent MIT-SHM segments, no per-frame copies (xshm.py)
+#
+# open_source() builds one from a --source string
+
+
+class Frame:
+    def __init__(self, size: Tuple[int, int], bgra, stride: int = 0):
+        self.size = size
+        self.bgra = bgra
+        self.stride = stride
+
+
+class FrameSource:
+    monitors: List[Dict[str, int]] = []
+
+    def grab(self, bb: Tuple[int, int, int, int]) -> Frame:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# [whole screen, monitor 1, monitor 2, ...] for monitor_count monitors side by side
+def side_by_side_monitors(width: int, height: int, monitor_count: int) -> List[Dict[str, int]]:
+    monitor_width = width // monitor_count
+    monitors = [{"left": 0, "top": 0, "width": width, "height": height}]
+    for i in range(monitor_count):
+        monitors.append({"left": i * monitor_width, "top": 0, "width": monitor_width, "height": height})
+    return monitors
+
+
+# Hands out a box of an (h, w, 4) BGRA array without copying it
+def grab_array(arr: np.ndarray, bb: Tuple[int, int, int, int], copy: bool = False) -> Frame:
+    left, top, right, bottom = bb
+    pixels = arr[top:bottom, left:right]
+    if copy:
+        return Frame((right - left, bottom - top), pixels.tobytes())
+
+    # the buffer has to start at the first pixel of the box and run to the end of the array
+    start = (top * arr.shape[1] + left) * 4
+    return Frame((right - left, bottom - top), memoryview(arr.reshape(-1))[start:], arr.strides[0])
+
+
+class MssSource(FrameSource):
+    def __init__(self):
+        import mss
+        self.mss = mss.mss()
+        self.monitors = self.mss.monitors
+
+    def grab(self, bb):
+        return self.mss.grab(bb)
+
+    def close(self):
+        self.mss.close()
+
+
+# Test patterns.  The pattern scrolls sideways 'speed' pixels per frame (at 'fps') so there's
+# something changing on screen, speed=0 keeps it still
+# copy=True copies every grab out of the pattern like mss does, for benchmarks
+class SyntheticSource(FrameSource):
+    PATTERNS = ["noise", "gradient", "bars"]
+
+    def __init__(self, width: int = 1920, height: int = 1080, monitor_count: int = 3,
+                 pattern: str = "gradient", speed: int = 8, fps: float = 30, copy: bool = False, seed: int = 0):
+        self.width = width * monitor_count
+        self.height = height
+        self.speed = speed
+        self.fps = fps
+        self.copy = copy
+        self.monitors = side_by_side_monitors(self.width, height, monitor_count)
+        self.start = time.perf_counter()
+
+        pattern_img = self.make_pattern(pattern, self.width, height, seed)
+        # twice as wide so a scrolled window never has to wrap around
+        self.frame = np.ascontiguousarray(np.concatenate([pattern_img, pattern_img], axis=1))
+
+    @staticmethod
+    def make_pattern(pattern: str, width: int, height: int, seed: int) -> np.ndarray:
+        arr = np.zeros((height, width, 4), dtype=np.uint8)
+        if pattern == "noise":
+            arr[..., :3] = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        elif pattern == "gradient":
+            x = np.linspace(0, 1, width, endpoint=False)
+            y = np.linspace(0, 1, height)[:, None]
+            arr[..., 0] = (255 * y).astype(np.uint8)                                   # blue
+            arr[..., 1] = (255 * (1 - np.abs(2 * x - 1)))[None, :].astype(np.uint8)   # green
+            arr[..., 2] = (255 * x)[None, :].astype(np.uint8)                         # red
+        elif pattern == "bars":
+            colors = np.array([[255, 255, 255], [0, 255, 255], [255, 255, 0], [0, 255, 0],
+                               [255, 0, 255], [0, 0, 255], [255, 0, 0], [0, 0, 0]], dtype=np.uint8)  # BGR
+            arr[..., :3] = colors[(np.arange(width) * len(colors) // width)][None, :, :]
+        else:
+            raise ValueError(f"unknown pattern: {pattern}")
+        return arr
+
+    def offset(self) -> int:
+        frame_no = int((time.perf_counter() - self.start) * self.fps)
+        return (frame_no * self.speed) % self.width
+
+    def grab(self, bb):
+        left, top, right, bottom = bb
+        offset = self.offset()
+        return grab_array(self.frame, (left + offset, top, right + offset, bottom), self.copy)
+
+
+# Plays a video file (needs opencv) or a sequence of images (a directory, or a glob like
+# 'frames/*.png') at 'fps', looping.  Every frame is scaled to width x height and split
+# into monitor_count monitors side by side
+class FileSource(FrameSource):
+    IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+    def __init__(self, path: str, width: int = 1920 * 3, height: int = 1080, monitor_count: int = 3,
+                 fps: Optional[float] = None):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.monitors = side_by_side_monitors(width, height, monitor_count)
+        self.start = time.perf_counter()
+
+        self.video = None
+        self.files: List[str] = []
+        if os.path.isdir(path):
+            self.files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(self.IMAGE_EXTENSIONS))
+        elif any(c in path for c in "*?["):
+            self.files = sorted(glob.glob(path))
+        elif path.lower().endswith(self.IMAGE_EXTENSIONS):
+            self.files = [path]
+        else:
+            try:
+                import cv2
+            except ImportError:
+                raise RuntimeError("reading video files needs opencv (pip install opencv-python)")
+            self.video = cv2.VideoCapture(path)
+            if not self.video.isOpened():
+                raise RuntimeError(f"could not open video: {path}")
+            fps = fps or self.video.get(cv2.CAP_PROP_FPS) or 30
+
+        if self.video is None and not self.files:
+            raise RuntimeError(f"no images found: {path}")
+
+        self.fps = fps or 30
+        self.frame_no = -1
+        self.frame = np.zeros((height, width, 4), dtype=np.uint8)
+
+    def to_bgra(self, img: PIL.Image.Image) -> np.ndarray:
+        img = img.convert("RGB").resize((self.width, self.height), resample=PIL.Image.BILINEAR)
+        arr = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        arr[..., :3] = np.asarray(img)[..., ::-1]
+        return arr
+
+    def next_video_frame(self) -> np.ndarray:
+        import cv2
+        ok, bgr = self.video.read()
+        if not ok:
+            # loop back to the start
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, bgr = self.video.read()
+            if not ok:
+                return self.frame
+        bgr = cv2.resize(bgr, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2BGRA)
+
+    def update(self):
+        frame_no = int((time.perf_counter() - self.start) * self.fps)
+        if frame_no == self.frame_no:
+            return
+
+        if self.video is not None:
+            # skip frames we were too slow for, but don't decode them
+            for _ in range(min(frame_no - self.frame_no - 1, int(self.fps))):
+                self.video.grab()
+            self.frame = self.next_video_frame()
+        else:
+            with PIL.Image.open(self.files[frame_no % len(self.files)]) as img:
+                self.frame = self.to_bgra(img)
+        self.frame_no = frame_no
+
+    def grab(self, bb):
+        self.update()
+        return grab_array(self.frame, bb)
+
+    def close(self):
+        if self.video is not None:
+            self.video.release()
+
+
+# Shared memory ring buffer layout:
+#   header (64 bytes): magic, version, width, height, slot count, sequence number of the newest frame
+#   slots: slot count x (width * height * 4) BGRA frames
+# Frame n is written to slot n % slots, then the header sequence is bumped.  Readers always read
+# the newest slot, with 3+ slots the writer is never touching the slot being read
+SHM_MAGIC = b"BLOOMSHM"
+SHM_VERSION = 1
+SHM_HEADER = struct.Struct("<8sIIIIQ")
+SHM_HEADER_SIZE = 64
+SHM_SEQUENCE_OFFSET = 24
+
+
+def _shm_size(width: int, height: int, slots: int) -> int:
+    return SHM_HEADER_SIZE + slots * width * height * 4
+
+
+# The producer side, for whatever tool is publishing frames:
+#
+#   publisher = SharedMemoryPublisher("/dev/shm/esp-bloom", 5760, 1080)
+#   frame = publisher.next_frame()   # (height, width, 4) BGRA numpy view of the next slot
+#   ... draw / copy into frame ...
+#   publisher.commit()
+class SharedMemoryPublisher:
+    def __init__(self, path: str, width: int, height: int, slots: int = 3):
+        self.width = width
+        self.height = height
+        self.slots = slots
+        self.sequence = 0
+
+        size = _shm_size(width, height, slots)
+        with open(path, "w+b") as f:
+            f.truncate(size)
+            self.mmap = mmap.mmap(f.fileno(), size)
+        SHM_HEADER.pack_into(self.mmap, 0, SHM_MAGIC, SHM_VERSION, width, height, slots, 0)
+
+        self.frames = np.frombuffer(self.mmap, dtype=np.uint8, offset=SHM_HEADER_SIZE).reshape(slots, height, width, 4)
+
+    def next_frame(self) -> np.ndarray:
+        return self.frames[(self.sequence + 1) % self.slots]
+
+    def commit(self):
+        self.sequence += 1
+        struct.pack_into("<Q", self.mmap, SHM_SEQUENCE_OFFSET, self.sequence)
+
+    def publish(self, bgra):
+        self.next_frame()[:] = np.frombuffer(bgra, dtype=np.uint8).reshape(self.height, self.width, 4)
+        self.commit()
+
+    def close(self):
+        del self.frames
+        self.mmap.close()
+
+
+class SharedMemorySource(FrameSource):
+    def __init__(self, path: str, monitor_count: int = 3):
+        with open(path, "r+b") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0)
+
+        magic, version, width, height, slots, _ = SHM_HEADER.unpack_from(self.mmap, 0)
+        if magic != SHM_MAGIC or version != SHM_VERSION:
+            raise RuntimeError(f"{path} is not an esp-bloom shared memory frame buffer")
+
+        self.width = width
+        self.height = height
+        self.slots = slots
+        self.monitors = side_by_side_monitors(width, height, monitor_count)
+        self.frames = np.frombuffer(self.mmap, dtype=np.uint8, offset=SHM_HEADER_SIZE).reshape(slots, height, width, 4)
+
+    def sequence(self) -> int:
+        return struct.unpack_from("<Q", self.mmap, SHM_SEQUENCE_OFFSET)[0]
+
+    # a view straight into the shared memory, nothing is copied
+    def grab(self, bb):
+        return grab_array(self.frames[self.sequence() % self.slots], bb)
+
+    def close(self):
+        del self.frames
+        self.mmap.close()
+
+
+# --source values:
+#   mss                              desktop screenshots (default)
+#   synthetic[:WIDTHxHEIGHT[:PATTERN]]  test pattern, WIDTHxHEIGHT per monitor
+#   file:PATH                        video file, image, directory of images or glob
+#   shm:PATH                         shared memory ring buffer written by SharedMemoryPublisher
+def open_source(spec: str) -> FrameSource:
+    kind, _, arg = spec.partition(":")
+    if kind == "mss":
+        return MssSource()
+    if kind == "synthetic":
+        size, _, pattern = arg.partition(":")
+        kwargs = {}
+        if size:
+            width, height = size.lower().split("x")
+            kwargs.update(width=int(width), height=int(height))
+        if pattern:
+            kwargs.update(pattern=pattern)
+        return SyntheticSource(**kwargs)
+    if kind == "file":
+        return FileSource(arg)
+    if kind == "shm":
+        return SharedMemorySource(arg)
+    if kind == "xshm":
+        from xshm import XShmSource
+        return XShmSource(arg or None)
+    raise ValueError(f"unknown frame source: {spec}")
@@ -0,0 +1,172 @@
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Any
+
+# Lightweight timing for the hot path, cheap enough to leave on at 60 fps.  Recording a sample
+# is a log2, a list increment and a clock read, nothing gets allocated.  The lock is only taken
+# for the first sample of a new name, rotating and taking a snapshot (the http server does that
+# from its own thread, while the other threads keep recording).
+#
+#   t = time.perf_counter()
+#   ...
+#   stats.record("resize", time.perf_counter() - t)
+#
+# Samples go into log-scale histograms (4 buckets per doubling, 1us - ~1s) that cover a rolling
+# window: every half window the oldest half gets thrown away (checked on every record and
+# snapshot, so it rolls whether or not anyone prints reports).  The numbers are reported as a
+# periodic stats line (report_line) and optionally as json over http (serve)
+
+BUCKETS_PER_OCTAVE = 4
+BUCKET_COUNT = 20 * BUCKETS_PER_OCTAVE + 1
+
+
+class Histogram:
+    def __init__(self):
+        self.current = [0] * BUCKET_COUNT
+        self.previous = [0] * BUCKET_COUNT
+        self.total = 0
+        self.max = 0.0
+        self.previous_max = 0.0
+
+    def record(self, seconds: float):
+        us = seconds * 1_000_000
+        bucket = int(math.log2(us) * BUCKETS_PER_OCTAVE) + 1 if us >= 1 else 0
+        self.current[min(bucket, BUCKET_COUNT - 1)] += 1
+        self.total += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def rotate(self):
+        self.previous = self.current
+        self.current = [0] * BUCKET_COUNT
+        self.previous_max = self.max
+        self.max = 0.0
+
+    # Percentiles are the upper edge of the bucket they land in (but never more than the max), in ms
+    def summary(self) -> Dict[str, float]:
+        counts = [a + b for a, b in zip(self.current, self.previous)]
+        count = sum(counts)
+        max_ms = max(self.max, self.previous_max) * 1000
+        summary = {"count": count, "max": max_ms}
+        for name, percentile in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+            target = percentile * count
+            seen = 0
+            value = 0.0
+            for bucket, bucket_count in enumerate(counts):
+                seen += bucket_count
+                if bucket_count and seen >= target:
+                    value = min(2 ** (bucket / BUCKETS_PER_OCTAVE) / 1000, max_ms)
+                    break
+            summary[name] = value
+        return summary
+
+
+class Stats:
+    def __init__(self, window: float = 10.0):
+        self.enabled = True
+        self.window = window
+        self.next_rotate = time.monotonic() + window / 2
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+
+        # extra numbers that live somewhere else (e.g. per-universe send counts), pulled in
+        # when a snapshot is taken
+        self.sources: Dict[str, Callable[[], Any]] = {}
+
+    def record(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        histogram.record(seconds)
+        if time.monotonic() >= self.next_rotate:
+            self.maybe_rotate()
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        if name not in self.counters:
+            with self.lock:
+                self.counters.setdefault(name, 0)
+        self.counters[name] += n
+
+    def add_source(self, name: str, fn: Callable[[], Any]):
+        self.sources[name] = fn
+
+    def maybe_rotate(self):
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.next_rotate:
+                for histogram in self.histograms.values():
+                    histogram.rotate()
+                self.next_rotate = now + self.window / 2
+
+    def snapshot(self) -> Dict[str, Any]:
+        self.maybe_rotate()
+        # copies, other threads may add names while we're summarizing
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = dict(self.counters)
+        snapshot = {
+            "timings": {name: histogram.summary() for name, histogram in histograms},
+            "counters": counters,
+        }
+        for name, fn in list(self.sources.items()):
+            snapshot[name] = fn()
+        return snapshot
+
+    # One line with p50/p99 of every timing, e.g. "grab.monitor-1 3.36/4.76ms resize.1-top 1.19/1.41ms ..."
+    def report_line(self) -> str:
+        parts = []
+        for name, summary in self.snapshot()["timings"].items():
+            if summary["count"]:
+                parts.append(f"{name} {summary['p50']:.2f}/{summary['p99']:.2f}ms")
+        return "p50/p99: " + " ".join(parts)
+
+
+# Serves the stats snapshot as json on http://127.0.0.1:<port>/
+class StatsServer:
+    def __init__(self, stats: Stats, port: int, host: str = "127.0.0.1"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(stats.snapshot(), indent=2).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # don't print a line for every request
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="stats-server", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# The process-wide stats every stage records into
+default_stats = Stats()
+
+record = default_stats.record
+count = default_stats.count
+add_source = default_stats.add_source
+snapshot = default_stats.snapshot
+report_line = default_stats.report_line
+
+
+def serve(port: int) -> StatsServer:
+    server = StatsServer(default_stats, port)
+    server.start()
+    return server
@@ -0,0 +1,92 @@
+import ctypes
+import os
+import shutil
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xshm  # noqa: E402
+from capture import CaptureCache  # noqa: E402
+
+WIDTH, HEIGHT = 640, 480
+
+
+# Runs against a throwaway Xvfb, skipped where there's none installed
+@unittest.skipIf(shutil.which("Xvfb") is None, "needs Xvfb")
+class XShmSourceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # -displayfd has Xvfb pick a free display and write its number once it's ready
+        read_fd, write_fd = os.pipe()
+        cls.xvfb = subprocess.Popen(["Xvfb", "-displayfd", str(write_fd), "-screen", "0", f"{WIDTH}x{HEIGHT}x24", "-nolisten", "tcp"],
+                                    pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            number = f.readline().strip()
+        if not number:
+            cls.xvfb.kill()
+            raise unittest.SkipTest("Xvfb didn't start")
+        cls.display = f":{number}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.xvfb.terminate()
+        cls.xvfb.wait()
+
+    def setUp(self):
+        self.source = xshm.XShmSource(self.display, max_segments=2)
+
+    def tearDown(self):
+        self.source.close()
+
+    def test_grab(self):
+        frame = self.source.grab((0, 0, WIDTH, HEIGHT))
+        self.assertEqual(frame.size, (WIDTH, HEIGHT))
+        self.assertGreaterEqual(frame.stride, WIDTH * 4)
+        self.assertEqual(len(frame.bgra), frame.stride * HEIGHT)
+
+    def test_segments_are_reused(self):
+        for _ in range(3):
+            self.source.grab((0, 10, WIDTH, 14))
+        self.assertEqual(self.source.allocations, 1)
+
+        # past max_segments the least recently grabbed box is freed
+        self.source.grab((0, 20, WIDTH, 24))
+        self.source.grab((0, 30, WIDTH, 34))
+        self.assertEqual(len(self.source.segments), 2)
+        self.assertNotIn((0, 10, WIDTH, 14), self.source.segments)
+
+    def test_freeing_a_segment_someone_is_looking_at(self):
+        frame = self.source.grab((0, 10, WIDTH, 14))
+        view = CaptureCache.bgra_array(frame.size, frame.bgra, frame.stride)
+        self.source.grab((0, 20, WIDTH, 24))
+        self.source.grab((0, 30, WIDTH, 34))
+
+        # stays mapped while the view is alive, unmapped with the next freed segment after that
+        self.assertEqual(len(self.source.retired), 1)
+        view.sum()  # would crash if it had been unmapped
+        del view
+        self.source.grab((0, 40, WIDTH, 44))
+        self.assertEqual(self.source.retired, [])
+
+    def test_error_handler_outlives_mss(self):
+        # opening the source asks mss for the monitors, which installs mss's own handler
+        previous = xshm._libraries()[0].XSetErrorHandler(xshm._error_handler)
+        self.assertEqual(previous, ctypes.cast(xshm._error_handler, ctypes.c_void_p).value)
+
+    def test_error_is_raised_once(self):
+        with self.assertRaises(RuntimeError):
+            self.source.grab((WIDTH - 10, 0, WIDTH + 10, 10))
+        # the error doesn't stick to the display (or leak into other displays)
+        self.source.grab((0, 0, 10, 10))
+        other = xshm.XShmSource(self.display)
+        try:
+            other.grab((0, 0, 10, 10))
+        finally:
+            other.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import multiprocessing
+import signal
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import PIL
+from PIL import Image
+
+import sources
+import stats
+from capture import CaptureCache
+from mapping import PixelStrip
+from region import ScreenRegion
+
+# Capture in worker processes, one per monitor.  Grabbing, the BGRX -> RGB conversion and
+# resizing down to the LED grid are all done in the worker, so the monitors are captured in
+# parallel on separate cores (threads don't help much, a lot of that work holds the GIL).
+#
+# Every frame the main process sends each worker the list of resizes its monitor needs (box,
+# size, band plan, filter), the worker writes the resized images into a shared memory block and
+# answers when it's done.  Only the tiny resized images cross over, the screenshots never leave
+# the worker and nothing big gets pickled.  The results go into CaptureCache.resized, where
+# ScreenRegion.resize_box picks them up instead of resizing itself.
+#
+# Workers open their own frame source from the --source spec, so this works for every source
+# that more than one process can open (mss, synthetic, shm, files)
+
+# (box, size, band plan, resample filter)
+Job = Tuple[Tuple, Tuple[int, int], Optional[Tuple], int]
+
+
+def _job_bytes(jobs: List[Job]) -> int:
+    return sum(size[0] * size[1] * 3 for _, size, _, _ in jobs)
+
+
+def _worker(monitor_no: int, source_spec: str, conn):
+    # forked with espbloom's Ctrl+C handler, which would close the sender / recorder a second
+    # time from in here.  The main process shuts us down (CaptureWorkers.close)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    source = sources.open_source(source_spec)
+    capture = CaptureCache(source)
+    shm: Optional[shared_memory.SharedMemory] = None
+    boxes = None
+
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            shm_name, downscale, jobs = message
+
+            if shm is None or shm.name != shm_name:
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=shm_name)
+
+            capture.downscale = downscale
+            job_boxes = [box for bb, _, band_plan, _ in jobs for box in ScreenRegion.capture_boxes(bb, band_plan)]
+            if job_boxes != boxes:
+                boxes = job_boxes
+                capture.unregister(None)
+                for box in boxes:
+                    capture.register(monitor_no, box)
+
+            t = time.perf_counter()
+            capture.new_frame()
+            offset = 0
+            for bb, size, band_plan, resample in jobs:
+                resized = ScreenRegion.resize_from_capture(capture, monitor_no, bb, size, band_plan, resample)
+                data = resized.tobytes()
+                shm.buf[offset:offset + len(data)] = data
+                offset += len(data)
+            conn.send(time.perf_counter() - t)
+    finally:
+        if shm is not None:
+            shm.close()
+        source.close()
+
+
+class CaptureWorkers:
+    def __init__(self, pixel_strips: List[PixelStrip], capture_cache: CaptureCache, source_spec: str):
+        self.pixel_strips = pixel_strips
+        self.capture_cache = capture_cache
+
+        # fork so the workers don't re-run espbloom.py (it's a script, there's no main guard)
+        context = multiprocessing.get_context("fork")
+
+        # start the shared memory tracker before forking so the workers share ours.  Otherwise each
+        # worker starts its own, which deletes the shared memory when the worker exits
+        resource_tracker.ensure_running()
+
+        self.connections = {}
+        self.processes = {}
+        self.shm: Dict[int, shared_memory.SharedMemory] = {}
+        for monitor_no in sorted(capture_cache.capture_boxes):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, args=(monitor_no, source_spec, child),
+                                      name=f"capture-{monitor_no}", daemon=True)
+            process.start()
+            self.connections[monitor_no] = parent
+            self.processes[monitor_no] = process
+
+    # What every monitor has to resize this frame, from the regions of every strip
+    def jobs(self) -> Dict[int, List[Job]]:
+        jobs: Dict[int, List[Job]] = {monitor_no: [] for monitor_no in self.connections}
+        for pixel_strip in self.pixel_strips:
+            img_x, img_y = pixel_strip.sample_size()
+            for region in pixel_strip.regions:
+                for monitor_no, bb, size in region.resize_jobs(img_x, img_y) or []:
+                    job = (bb, size, region.band_plan, region.resample)
+                    if job not in jobs[monitor_no]:
+                        jobs[monitor_no].append(job)
+        return jobs
+
+    def shared_memory(self, monitor_no: int, size: int) -> shared_memory.SharedMemory:
+        shm = self.shm.get(monitor_no)
+        if shm is None or shm.size < size:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = self.shm[monitor_no] = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        return shm
+
+    # Capture + resize every monitor in parallel.  Call right after capture_cache.new_frame()
+    def capture(self):
+        t = time.perf_counter()
+        jobs = self.jobs()
+        for monitor_no, conn in self.connections.items():
+            shm = self.shared_memory(monitor_no, _job_bytes(jobs[monitor_no]))
+            conn.send((shm.name, self.capture_cache.downscale, jobs[monitor_no]))
+
+        for monitor_no, conn in self.connections.items():
+            worker_time = conn.recv()
+            stats.record(f"worker.monitor-{monitor_no}", worker_time)
+
+            buf = self.shm[monitor_no].buf
+            offset = 0
+            for bb, size, band_plan, resample in jobs[monitor_no]:
+                length = size[0] * size[1] * 3
+                img = PIL.Image.frombytes("RGB", size, bytes(buf[offset:offset + length]))
+                self.capture_cache.resized[(monitor_no, bb, size, band_plan, resample)] = img
+                offset += length
+        stats.record("capture.workers", time.perf_counter() - t)
+
+    def close(self):
+        for conn in self.connections.values():
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes.values():
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        for shm in self.shm.values():
+            shm.close()
+            shm.unlink()
+        self.shm = {}
@@ -0,0 +1,324 @@
+import ctypes
+import ctypes.util
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sources import Frame, FrameSource
+
+# X11 capture through the MIT-SHM extension, straight from libX11/libXext with ctypes.
+#
+# mss allocates a new ScreenShot and copies the pixels out of its XImage on every grab.  Here
+# every box we capture (a monitor, or a band from capture planning) gets its own shared memory
+# XImage the first time it's grabbed, and after that XShmGetImage has the X server write the
+# pixels straight into it.  grab() hands out a memoryview of the segment (with its stride), so
+# nothing is allocated or copied on our side per frame: CaptureCache reads the BGRX bytes in
+# place (the RGB conversion / pyramid / decimation is the first thing that touches them).
+#
+# The segment is overwritten by the next grab of the same box, so the frame is only good until
+# then.  CaptureCache converts it right away, so that's fine for everything that goes through
+# it.  Every capture thread / worker opens its own XShmSource, so they don't share segments.
+#
+# Needs a local X server with MIT-SHM (not over ssh -X).  Works with Xvfb:
+#
+#   Xvfb :99 -screen 0 5760x1080x24 &
+#   python espbloom.py --source xshm::99
+
+ZPIXMAP = 2
+ALL_PLANES = 0xffffffffffffffff
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+# segments for boxes that haven't been grabbed in a while are freed past this many (capture
+# planning / the quality controller moving the bands around)
+MAX_SEGMENTS = 64
+
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ("shmseg", ctypes.c_ulong),
+        ("shmid", ctypes.c_int),
+        ("shmaddr", ctypes.c_void_p),
+        ("readOnly", ctypes.c_int),
+    ]
+
+
+class XImage(ctypes.Structure):
+    pass
+
+
+class XImageFuncs(ctypes.Structure):
+    _fields_ = [
+        ("create_image", ctypes.c_void_p),
+        ("destroy_image", ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(XImage))),
+        ("get_pixel", ctypes.c_void_p),
+        ("put_pixel", ctypes.c_void_p),
+        ("sub_image", ctypes.c_void_p),
+        ("add_pixel", ctypes.c_void_p),
+    ]
+
+
+XImage._fields_ = [
+    ("width", ctypes.c_int),
+    ("height", ctypes.c_int),
+    ("xoffset", ctypes.c_int),
+    ("format", ctypes.c_int),
+    ("data", ctypes.c_void_p),
+    ("byte_order", ctypes.c_int),
+    ("bitmap_unit", ctypes.c_int),
+    ("bitmap_bit_order", ctypes.c_int),
+    ("bitmap_pad", ctypes.c_int),
+    ("depth", ctypes.c_int),
+    ("bytes_per_line", ctypes.c_int),
+    ("bits_per_pixel", ctypes.c_int),
+    ("red_mask", ctypes.c_ulong),
+    ("green_mask", ctypes.c_ulong),
+    ("blue_mask", ctypes.c_ulong),
+    ("obdata", ctypes.c_void_p),
+    ("f", XImageFuncs),
+]
+
+
+class XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("display", ctypes.c_void_p),
+        ("resourceid", ctypes.c_ulong),
+        ("serial", ctypes.c_ulong),
+        ("error_code", ctypes.c_ubyte),
+        ("request_code", ctypes.c_ubyte),
+        ("minor_code", ctypes.c_ubyte),
+    ]
+
+
+XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(XErrorEvent))
+
+
+def _load(name: str) -> ctypes.CDLL:
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise RuntimeError(f"xshm capture needs lib{name}")
+    return ctypes.CDLL(path, use_errno=True)
+
+
+_libs: Dict[str, ctypes.CDLL] = {}
+
+# X errors by display, set by the error handler (the default Xlib handler exits the process).
+# Every capture thread has its own display, so one thread's error never shows up in another's
+_errors: Dict[int, List[XErrorEvent]] = {}
+
+
+@XErrorHandler
+def _error_handler(display, event):
+    _errors.setdefault(display, []).append(XErrorEvent.from_buffer_copy(event.contents))
+    return 0
+
+
+# The last error on the display since the last call (and forget the rest), None if there wasn't one
+def _take_error(display) -> Optional[XErrorEvent]:
+    errors = _errors.pop(display, None)
+    return errors[-1] if errors else None
+
+
+def _libraries() -> Tuple[ctypes.CDLL, ctypes.CDLL, ctypes.CDLL]:
+    if not _libs:
+        x11 = _load("X11")
+        xext = _load("Xext")
+        libc = _load("c")
+
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSetErrorHandler.argtypes = [XErrorHandler]
+        x11.XSetErrorHandler.restype = ctypes.c_void_p
+
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+        xext.XShmCreateImage.restype = ctypes.POINTER(XImage)
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XImage),
+                                      ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+        x11.XSetErrorHandler(_error_handler)
+        _libs.update(x11=x11, xext=xext, libc=libc)
+    return _libs["x11"], _libs["xext"], _libs["libc"]
+
+
+# One box's shared memory XImage
+class Segment:
+    def __init__(self, display, visual, depth: int, width: int, height: int):
+        x11, xext, libc = _libraries()
+        self.display = display
+        self.size = (width, height)
+        self.attached = False
+        self.info = XShmSegmentInfo()
+        self.image = xext.XShmCreateImage(display, visual, depth, ZPIXMAP, None, ctypes.byref(self.info), width, height)
+        if not self.image:
+            raise RuntimeError(f"XShmCreateImage failed for {width}x{height}")
+        image = self.image.contents
+        if image.bits_per_pixel != 32:
+            self.destroy_image()
+            raise RuntimeError(f"xshm capture needs a 32 bit per pixel visual, got {image.bits_per_pixel}")
+        self.stride = image.bytes_per_line
+        length = self.stride * height
+
+        self.info.shmid = libc.shmget(IPC_PRIVATE, length, IPC_CREAT | 0o600)
+        if self.info.shmid < 0:
+            self.destroy_image()
+            raise OSError(ctypes.get_errno(), f"shmget of {length} bytes failed")
+        address = libc.shmat(self.info.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            libc.shmctl(self.info.shmid, IPC_RMID, None)
+            self.destroy_image()
+            raise OSError(ctypes.get_errno(), "shmat failed")
+        self.info.shmaddr = address
+        self.info.readOnly = 0
+        image.data = address
+
+        attached = xext.XShmAttach(display, ctypes.byref(self.info))
+        x11.XSync(display, 0)
+        # gone as soon as both sides detach, even if we crash
+        libc.shmctl(self.info.shmid, IPC_RMID, None)
+        error = _take_error(display)
+        if not attached or error is not None:
+            libc.shmdt(address)
+            self.destroy_image()
+            raise RuntimeError(f"XShmAttach failed (error {error.error_code if error else '?'}), "
+                               f"MIT-SHM only works with a local X server")
+        self.attached = True
+
+        # the pixels, in place
+        self.buffer = memoryview((ctypes.c_ubyte * length).from_address(address)).cast("B")
+        self.mapped = True
+
+    def destroy_image(self):
+        if self.image:
+            self.image.contents.f.destroy_image(self.image)
+            self.image = None
+
+    # Detach from the X server and unmap.  Returns False if the mapping had to stay because a
+    # frame (e.g. a numpy view of it) is still looking at it, call unmap() again later
+    def close(self) -> bool:
+        x11, xext, _ = _libraries()
+        if self.attached:
+            xext.XShmDetach(self.display, ctypes.byref(self.info))
+            x11.XSync(self.display, 0)
+            self.attached = False
+        self.destroy_image()
+        return self.unmap()
+
+    def unmap(self) -> bool:
+        if self.mapped:
+            try:
+                self.buffer.release()
+            except BufferError:
+                # shmdt now and whoever still holds the view reads unmapped memory
+                return False
+            _libraries()[2].shmdt(self.info.shmaddr)
+            self.mapped = False
+        return True
+
+
+class XShmSource(FrameSource):
+    def __init__(self, display_name: Optional[str] = None, max_segments: int = MAX_SEGMENTS):
+        x11, xext, _ = _libraries()
+        self.display_name = display_name or os.environ.get("DISPLAY")
+        self.display = x11.XOpenDisplay(self.display_name.encode() if self.display_name else None)
+        if not self.display:
+            raise RuntimeError(f"can't open X display {self.display_name}")
+        if not xext.XShmQueryExtension(self.display):
+            x11.XCloseDisplay(self.display)
+            raise RuntimeError(f"X display {self.display_name} doesn't support MIT-SHM")
+
+        screen = x11.XDefaultScreen(self.display)
+        self.root = x11.XRootWindow(self.display, screen)
+        self.visual = x11.XDefaultVisual(self.display, screen)
+        self.depth = x11.XDefaultDepth(self.display, screen)
+        self.monitors = self.find_monitors(x11.XDisplayWidth(self.display, screen), x11.XDisplayHeight(self.display, screen))
+
+        self.max_segments = max_segments
+        self.segments: "OrderedDict[Tuple[int, int, int, int], Segment]" = OrderedDict()
+        # closed segments that couldn't be unmapped yet, retried whenever a segment is freed
+        self.retired: List[Segment] = []
+        # segments created, stays at the number of boxes once everything has been grabbed once
+        self.allocations = 0
+
+    def __str__(self):
+        return f"XShmSource[{self.display_name},segments={len(self.segments)}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+    # Same monitor layout as mss (it asks XRandR), so fixtures.py's monitor numbers mean the same
+    # thing.  Without mss it's just the whole screen as monitor 1
+    def find_monitors(self, width: int, height: int) -> List[Dict[str, int]]:
+        whole = {"left": 0, "top": 0, "width": width, "height": height}
+        try:
+            import mss
+            with mss.mss(display=self.display_name) as sct:
+                return list(sct.monitors)
+        except Exception:
+            return [whole, dict(whole)]
+        finally:
+            # mss installs its own Xlib error handler and leaves it there, ours would never see
+            # another error (there's only one handler per process)
+            _libraries()[0].XSetErrorHandler(_error_handler)
+
+    def segment(self, bb: Tuple[int, int, int, int]) -> Segment:
+        segment = self.segments.get(bb)
+        if segment is not None:
+            self.segments.move_to_end(bb)
+            return segment
+
+        left, top, right, bottom = bb
+        segment = self.segments[bb] = Segment(self.display, self.visual, self.depth, right - left, bottom - top)
+        self.allocations += 1
+        while len(self.segments) > self.max_segments:
+            _, oldest = self.segments.popitem(last=False)
+            self.retire(oldest)
+        return segment
+
+    def retire(self, segment: Segment):
+        self.retired = [retired for retired in self.retired if not retired.unmap()]
+        if not segment.close():
+            self.retired.append(segment)
+
+    def grab(self, bb):
+        x11, xext, _ = _libraries()
+        segment = self.segment(tuple(bb))
+        ok = xext.XShmGetImage(self.display, self.root, segment.image, bb[0], bb[1], ALL_PLANES)
+        error = _take_error(self.display)
+        if not ok or error is not None:
+            raise RuntimeError(f"XShmGetImage failed for {bb} (error {error.error_code if error else '?'}), "
+                               f"is the box on the screen?")
+        return Frame(segment.size, segment.buffer, segment.stride)
+
+    def close(self):
+        if self.display is None:
+            return
+        x11, _, _ = _libraries()
+        for segment in self.segments.values():
+            self.retire(segment)
+        self.segments.clear()
+        # anything still in self.retired stays mapped until the process exits
+        x11.XCloseDisplay(self.display)
+        _errors.pop(self.display, None)
+        self.display = None